@@ -61,7 +61,11 @@ Example response:
 Press Ctrl+C to stop.
 """)
     
-    await gateway.start()
+    try:
+        await gateway.start()
+    finally:
+        # Flush pending session saves on Ctrl+C / shutdown
+        await gateway.stop()
 
 
 if __name__ == "__main__":
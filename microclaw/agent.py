@@ -19,7 +19,7 @@ from enum import Enum
 from typing import AsyncIterator, Callable, Dict, List, Optional, Union
 
 from .memory import MemoryConfig, WorkspaceFiles, create_memory_tools
-from .session import Compactor, Message, MessageRole, Session
+from .session import Compactor, Message, MessageRole, Session, estimate_tokens
 from .tools import ToolRegistry, get_builtin_tools
 
 
@@ -489,6 +489,15 @@ class Agent:
         response = self._call_llm(messages_for_summary, [])
         return response.content
 
+    async def _maybe_compact(self, session: Session):
+        """会话接近上下文窗口上限时压缩较早的历史。"""
+        if self._compactor is None:
+            return
+        if session.token_estimator is None:
+            session.set_token_estimator(estimate_tokens)
+        if self._compactor.should_compact(session, self.config.context_window):
+            await self._compactor.compact(session)
+
     async def run(
         self,
         message: str,
@@ -510,9 +519,12 @@ class Agent:
         """
         # 将用户消息添加到会话
         user_msg = session.add_user_message(message)
+        await self._maybe_compact(session)
 
-        # 构建带有工作区上下文的系统提示
-        system_prompt = self._build_system_prompt(is_main_session=is_main_session)
+        # 构建带有工作区上下文的系统提示 (在线程中读取文件，不阻塞事件循环)
+        system_prompt = await asyncio.to_thread(
+            self._build_system_prompt, is_main_session
+        )
 
         # 获取工具模式
         tool_schemas = self.tools.schemas()
@@ -614,9 +626,12 @@ class Agent:
         """
         # 将用户消息添加到会话
         user_msg = session.add_user_message(message)
+        await self._maybe_compact(session)
 
-        # 构建带有工作区上下文的系统提示
-        system_prompt = self._build_system_prompt(is_main_session=is_main_session)
+        # 构建带有工作区上下文的系统提示 (在线程中读取文件，不阻塞事件循环)
+        system_prompt = await asyncio.to_thread(
+            self._build_system_prompt, is_main_session
+        )
 
         # 获取工具模式
         tool_schemas = self.tools.schemas()
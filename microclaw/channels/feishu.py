@@ -204,7 +204,7 @@ class FeishuChannel:
                 sender=open_id,
                 content=content,
                 group_id=group_id,
-                metadata=msg_data.get("metadata", {}),
+                metadata=msg_data.get("metadata"),
             )
 
             if self._on_message:
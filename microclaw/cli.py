@@ -191,7 +191,9 @@ def main():
 
     # 添加适当的通道
     if args.webhook:
-        gateway.add_channel(WebhookChannel(port=args.port))
+        webhook_channel = WebhookChannel(port=args.port)
+        webhook_channel.set_stream_handler(gateway.handle_message_stream)
+        gateway.add_channel(webhook_channel)
 
     # 添加飞书通道 (如果配置了)
     if feishu_channel:
@@ -280,7 +282,9 @@ def run_gateway(args):
     gateway.add_channel(CLIChannel())
 
     if args.webhook:
-        gateway.add_channel(WebhookChannel(port=args.port))
+        webhook_channel = WebhookChannel(port=args.port)
+        webhook_channel.set_stream_handler(gateway.handle_message_stream)
+        gateway.add_channel(webhook_channel)
 
     print_banner_full()
     gateway.run()
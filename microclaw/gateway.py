@@ -10,6 +10,10 @@ Gateway 是连接一切的中心:
 """
 
 import asyncio
+import json
+import logging
+import threading
+import time
 from dataclasses import dataclass, field
 from datetime import datetime
 from pathlib import Path
@@ -17,9 +21,21 @@ from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Protocol,
 
 from .agent import Agent, AgentConfig
 from .memory import MemoryConfig, WorkspaceFiles
-from .session import ResetPolicy, Session, SessionKey, SessionStore
+from .session import ResetPolicy, Session, SessionKey, SessionStore, estimate_tokens
 from .tools import Tool, ToolRegistry
 
+try:
+    import orjson
+except ImportError:  # 可选依赖，未安装时使用标准库 json
+    orjson = None
+
+try:
+    from aiohttp import web
+except ImportError:  # 可选依赖，仅 WebhookChannel 需要
+    web = None
+
+logger = logging.getLogger(__name__)
+
 # === 通道协议 ===
 
 
@@ -44,19 +60,24 @@ class Channel(Protocol):
 # === 消息类型 ===
 
 
-@dataclass
+@dataclass(slots=True)
 class IncomingMessage:
     """从通道接收的消息。"""
 
     channel: str
     sender: str
     content: str
-    timestamp: datetime = field(default_factory=datetime.now)
+    received_at: float = field(default_factory=time.time)  # POSIX 时间戳
 
     # 可选元数据
     group_id: Optional[str] = None  # 用于群组消息
     reply_to: Optional[str] = None  # 被回复的消息
-    metadata: Dict[str, Any] = field(default_factory=dict)
+    metadata: Optional[Dict[str, Any]] = None
+
+    @property
+    def timestamp(self) -> datetime:
+        """接收时间 (按需转换为 datetime)。"""
+        return datetime.fromtimestamp(self.received_at)
 
     @property
     def is_group(self) -> bool:
@@ -111,6 +132,7 @@ class GatewayConfig:
     reset_mode: str = "daily"  # daily, idle, both
     reset_hour: int = 4  # 每日重置的小时
     idle_minutes: Optional[int] = None
+    max_loaded_messages: Optional[int] = None  # 从磁盘加载会话时保留的最近消息数
 
     # 所有者 (特权用户 ID)
     owner_ids: List[str] = field(default_factory=list)
@@ -133,6 +155,12 @@ class Gateway:
     - 事件系统支持扩展
     """
 
+    # 会话键缓存上限
+    _KEY_CACHE_SIZE = 4096
+
+    # 会话保存的合并延迟 (秒)
+    _SAVE_DELAY = 0.25
+
     def __init__(self, config: Optional[GatewayConfig] = None):
         self.config = config or GatewayConfig()
 
@@ -152,7 +180,10 @@ class Gateway:
         )
 
         self._sessions = SessionStore(
-            storage_dir=str(self._base_dir / "sessions"), reset_policy=reset_policy
+            storage_dir=str(self._base_dir / "sessions"),
+            reset_policy=reset_policy,
+            max_loaded_messages=self.config.max_loaded_messages,
+            token_estimator=estimate_tokens,
         )
 
         # 工作区
@@ -167,8 +198,15 @@ class Gateway:
         # 事件处理器
         self._handlers: Dict[str, List[Callable]] = {}
 
-        # 状态
-        self._running = False
+        # 会话键缓存: (channel, sender, group_id) -> SessionKey
+        self._key_cache: Dict[tuple, SessionKey] = {}
+
+        # 待保存的会话 (合并写入): key -> Session
+        self._dirty_sessions: Dict[str, Session] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+
+        # 停止信号 (在 start 中创建，需要运行中的事件循环)
+        self._stop_event: Optional[asyncio.Event] = None
 
     @property
     def agent(self) -> Agent:
@@ -228,13 +266,43 @@ class Gateway:
 
     async def _emit(self, event: str, *args, **kwargs):
         """向所有处理器发出事件。"""
-        for handler in self._handlers.get(event, []):
+        handlers = self._handlers.get(event)
+        if not handlers:
+            return
+
+        for handler in handlers:
             try:
                 result = handler(*args, **kwargs)
                 if asyncio.iscoroutine(result):
                     await result
-            except Exception as e:
-                print(f"事件处理器错误 {event}: {e}")
+            except Exception:
+                logger.exception("事件处理器错误 %s", event)
+
+    def _emit_nowait(self, event: str, *args, **kwargs):
+        """
+        从同步上下文发出事件。
+
+        同步处理器直接调用，只有异步处理器返回的协程才会创建任务。
+        """
+        handlers = self._handlers.get(event)
+        if not handlers:
+            return
+
+        for handler in handlers:
+            try:
+                result = handler(*args, **kwargs)
+            except Exception:
+                logger.exception("事件处理器错误 %s", event)
+                continue
+            if asyncio.iscoroutine(result):
+                asyncio.create_task(self._await_handler(event, result))
+
+    async def _await_handler(self, event: str, coro):
+        """等待异步处理器并记录其异常。"""
+        try:
+            await coro
+        except Exception:
+            logger.exception("事件处理器错误 %s", event)
 
     # === 消息处理 ===
 
@@ -247,17 +315,11 @@ class Gateway:
         await self._emit("message_received", msg)
 
         # 获取或创建会话
-        session_key = msg.get_session_key(
-            agent_id="main", dm_scope=self.config.dm_scope
-        )
-        session = self._sessions.get(session_key)
+        session_key = self._session_key_for(msg)
+        session = self._get_session(session_key)
 
         # 更新会话来源
-        session.origin = {
-            "channel": msg.channel,
-            "sender": msg.sender,
-            "group_id": msg.group_id,
-        }
+        self._update_origin(session, msg)
 
         # 检查斜杠命令
         if msg.content.startswith("/"):
@@ -268,7 +330,7 @@ class Gateway:
 
         # 工具回调
         def on_tool(event: str, name: str, data: Any):
-            asyncio.create_task(self._emit("tool_call", event, name, data))
+            self._emit_nowait("tool_call", event, name, data)
 
         # 确定是否为主会话 (用于记忆加载)
         is_main = not msg.is_group and self.config.dm_scope == "main"
@@ -285,8 +347,8 @@ class Gateway:
             response = f"处理消息时出错: {e}"
             await self._emit("error", e)
 
-        # 保存会话
-        self._sessions.save(session)
+        # 保存会话 (延迟合并写入)
+        self._schedule_save(session)
 
         await self._emit("response_ready", msg, response)
 
@@ -305,17 +367,11 @@ class Gateway:
         await self._emit("message_received", msg)
 
         # 获取或创建会话
-        session_key = msg.get_session_key(
-            agent_id="main", dm_scope=self.config.dm_scope
-        )
-        session = self._sessions.get(session_key)
+        session_key = self._session_key_for(msg)
+        session = self._get_session(session_key)
 
         # 更新会话来源
-        session.origin = {
-            "channel": msg.channel,
-            "sender": msg.sender,
-            "group_id": msg.group_id,
-        }
+        self._update_origin(session, msg)
 
         # 检查斜杠命令
         if msg.content.startswith("/"):
@@ -327,7 +383,7 @@ class Gateway:
 
         # 工具回调
         def on_tool(event: str, name: str, data: Any):
-            asyncio.create_task(self._emit("tool_call", event, name, data))
+            self._emit_nowait("tool_call", event, name, data)
 
         # 确定是否为主会话 (用于记忆加载)
         is_main = not msg.is_group and self.config.dm_scope == "main"
@@ -340,6 +396,8 @@ class Gateway:
                 on_tool_call=on_tool,
                 is_main_session=is_main,
             ):
+                if isinstance(chunk, str):
+                    await self._emit("response_chunk", msg, chunk)
                 yield chunk
 
         except Exception as e:
@@ -347,11 +405,78 @@ class Gateway:
             yield error_msg
             await self._emit("error", e)
 
-        # 保存会话
-        self._sessions.save(session)
+        # 保存会话 (延迟合并写入)
+        self._schedule_save(session)
 
         await self._emit("response_ready", msg, "")
 
+    def _get_session(self, session_key: SessionKey) -> Session:
+        """获取会话；存储因过期替换了会话时，丢弃旧会话的待保存标记。"""
+        session = self._sessions.get(session_key)
+        key_str = str(session_key)
+        dirty = self._dirty_sessions.get(key_str)
+        if dirty is not None and dirty is not session:
+            # 旧会话的消息已在替换前写入转录，再保存会把旧 ID 写回元数据
+            del self._dirty_sessions[key_str]
+        return session
+
+    def _schedule_save(self, session: Session) -> None:
+        """标记会话待保存，短时间内的多次保存合并为一次写入。"""
+        self._dirty_sessions[str(session.key)] = session
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        try:
+            await asyncio.sleep(self._SAVE_DELAY)
+        finally:
+            # 任务被取消 (如 asyncio.run 退出、Ctrl+C) 时也写入，不丢失会话
+            self._flush_sessions()
+
+    def _flush_sessions(self) -> None:
+        """立即保存所有待保存的会话。"""
+        dirty, self._dirty_sessions = self._dirty_sessions, {}
+        for session in dirty.values():
+            self._sessions.save(session)
+
+    def _session_key_for(self, msg: IncomingMessage) -> SessionKey:
+        """获取消息的会话键，重复的发送者复用已缓存的键。"""
+        cache_key = (msg.channel, msg.sender, msg.group_id)
+        session_key = self._key_cache.get(cache_key)
+        if session_key is None:
+            session_key = msg.get_session_key(
+                agent_id="main", dm_scope=self.config.dm_scope
+            )
+            if len(self._key_cache) < self._KEY_CACHE_SIZE:
+                self._key_cache[cache_key] = session_key
+        return session_key
+
+    def _update_origin(self, session: Session, msg: IncomingMessage) -> None:
+        """更新会话来源，来源未变化时不重建字典。"""
+        origin = session.origin
+        if (
+            len(origin) == 3
+            and origin.get("channel") == msg.channel
+            and origin.get("sender") == msg.sender
+            and origin.get("group_id", 0) == msg.group_id
+        ):
+            return
+
+        session.origin = {
+            "channel": msg.channel,
+            "sender": msg.sender,
+            "group_id": msg.group_id,
+        }
+
+    # 斜杠命令 -> 处理方法名
+    _SLASH_COMMANDS: Dict[str, str] = {
+        "/status": "_cmd_status",
+        "/new": "_cmd_reset",
+        "/reset": "_cmd_reset",
+        "/help": "_cmd_help",
+        "/context": "_cmd_context",
+    }
+
     async def _handle_slash_command(
         self, content: str, session: Session
     ) -> Optional[str]:
@@ -360,26 +485,34 @@ class Gateway:
 
         如果已处理则返回响应字符串，传递给 Agent 则返回 None。
         """
-        parts = content.strip().split(maxsplit=1)
-        cmd = parts[0].lower()
+        # 按任意空白分割，命令后跟制表符或换行也能识别
+        parts = content.split(None, 1)
+        if not parts:
+            return None
+        method = self._SLASH_COMMANDS.get(parts[0].lower())
         args = parts[1] if len(parts) > 1 else ""
 
-        if cmd == "/status":
-            return self._format_status(session)
+        # 未知命令 - 传递给 Agent
+        if method is None:
+            return None
 
-        elif cmd in ("/new", "/reset"):
-            new_session = self._sessions.reset(session.key)
-            return f"[重置] 会话已重置。新 ID: {new_session.session_id}"
+        return await getattr(self, method)(session, args.strip())
 
-        elif cmd == "/help":
-            return self._format_help()
+    async def _cmd_status(self, session: Session, args: str) -> str:
+        return self._format_status(session)
 
-        elif cmd == "/context":
-            context = self._workspace.build_context(is_main_session=True)
-            return f"[上下文] 长度: {len(context)} 字符\n\n{context[:2000]}..."
+    async def _cmd_reset(self, session: Session, args: str) -> str:
+        # 先写入待保存的旧会话，避免延迟写入覆盖新会话的元数据
+        self._flush_sessions()
+        new_session = self._sessions.reset(session.key)
+        return f"[重置] 会话已重置。新 ID: {new_session.session_id}"
 
-        # 未知命令 - 传递给 Agent
-        return None
+    async def _cmd_help(self, session: Session, args: str) -> str:
+        return self._format_help()
+
+    async def _cmd_context(self, session: Session, args: str) -> str:
+        context = await asyncio.to_thread(self._workspace.build_context, True)
+        return f"[上下文] 长度: {len(context)} 字符\n\n{context[:2000]}..."
 
     def _format_status(self, session: Session) -> str:
         """格式化状态信息。"""
@@ -421,7 +554,7 @@ class Gateway:
 
     async def start(self):
         """启动所有通道并开始处理。"""
-        self._running = True
+        self._stop_event = asyncio.Event()
         await self._emit("starting")
 
         # 启动所有通道
@@ -429,25 +562,32 @@ class Gateway:
             try:
                 await channel.start(self.handle_message)
                 print(f"[OK] 通道已启动: {name}", flush=True)
-            except Exception as e:
-                print(f"[FAIL] 启动失败 {name}: {e}", flush=True)
+            except Exception:
+                logger.exception("[FAIL] 启动失败 %s", name)
 
         await self._emit("started")
 
-        # 保持运行
-        while self._running:
-            await asyncio.sleep(1)
+        # 保持运行，直到 stop() 发出信号
+        await self._stop_event.wait()
 
     async def stop(self):
         """停止所有通道并关闭。"""
-        self._running = False
+        if self._stop_event is not None:
+            self._stop_event.set()
         await self._emit("stopping")
 
-        for channel in self._channels.values():
+        for name, channel in self._channels.items():
             try:
                 await channel.stop()
             except Exception:
-                pass
+                logger.exception("停止通道失败 %s", name)
+
+        # 写入所有待保存的会话
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        self._flush_sessions()
+        await self._sessions.wait_archives()
 
         await self._emit("stopped")
 
@@ -478,6 +618,10 @@ class CLIChannel:
         self._on_message_stream: Optional[Callable] = None
         self._running = False
 
+        # 专用读取线程通过队列传递输入行 (None 表示输入结束)
+        self._queue: Optional[asyncio.Queue] = None
+        self._ready = threading.Event()
+
     async def send(self, to: str, message: str) -> bool:
         """发送消息（非流式模式使用）。"""
         print(f"\n[助手] {message}\n")
@@ -487,6 +631,10 @@ class CLIChannel:
         """启动通道。"""
         self._on_message = on_message
         self._running = True
+        self._queue = asyncio.Queue()
+
+        loop = asyncio.get_running_loop()
+        threading.Thread(target=self._reader, args=(loop,), daemon=True).start()
         asyncio.create_task(self._input_loop())
 
     def set_stream_handler(self, handler: Callable):
@@ -499,8 +647,11 @@ class CLIChannel:
 
         while self._running:
             try:
-                loop = asyncio.get_event_loop()
-                line = await loop.run_in_executor(None, lambda: input("你: "))
+                # 通知读取线程显示提示符并读取下一行
+                self._ready.set()
+                line = await self._queue.get()
+                if line is None:
+                    break
 
                 if not line.strip():
                     continue
@@ -517,11 +668,26 @@ class CLIChannel:
                     if response:
                         self._safe_print(response)
 
-            except EOFError:
-                break
             except KeyboardInterrupt:
                 break
 
+    def _reader(self, loop: asyncio.AbstractEventLoop):
+        """在专用线程中读取标准输入，每次读取前等待上一条消息处理完毕。"""
+        while True:
+            self._ready.wait()
+            self._ready.clear()
+            if not self._running:
+                return
+
+            try:
+                line = input("你: ")
+            except (EOFError, KeyboardInterrupt):
+                line = None
+
+            loop.call_soon_threadsafe(self._queue.put_nowait, line)
+            if line is None:
+                return
+
     async def _handle_stream(self, msg: IncomingMessage):
         """流式处理消息。"""
         print("\n[助手] ", end="", flush=True)
@@ -566,6 +732,9 @@ class CLIChannel:
 
     async def stop(self) -> None:
         self._running = False
+        self._ready.set()
+        if self._queue is not None:
+            self._queue.put_nowait(None)
 
 
 class WebhookChannel:
@@ -574,28 +743,31 @@ class WebhookChannel:
     name = "webhook"
 
     def __init__(self, host: str = "0.0.0.0", port: int = 8080):
+        if web is None:
+            raise ImportError("webhook 需要 aiohttp: pip install aiohttp")
+
         self.host = host
         self.port = port
         self._on_message: Optional[Callable] = None
+        self._on_message_stream: Optional[Callable] = None
         self._server = None
 
+        # 路由只在构造时注册一次
+        self._app = web.Application()
+        self._app.router.add_post("/message", self._handle_webhook)
+        self._app.router.add_get("/health", self._health)
+
     async def send(self, to: str, message: str) -> bool:
         return True
 
+    def set_stream_handler(self, handler: Callable):
+        """设置流式消息处理器 (请求体包含 "stream": true 时使用)。"""
+        self._on_message_stream = handler
+
     async def start(self, on_message: Callable) -> None:
         self._on_message = on_message
 
-        try:
-            from aiohttp import web
-        except ImportError:
-            print("webhook 需要 aiohttp: pip install aiohttp")
-            return
-
-        app = web.Application()
-        app.router.add_post("/message", self._handle_webhook)
-        app.router.add_get("/health", self._health)
-
-        runner = web.AppRunner(app)
+        runner = web.AppRunner(self._app)
         await runner.setup()
         self._server = web.TCPSite(runner, self.host, self.port)
         await self._server.start()
@@ -603,31 +775,76 @@ class WebhookChannel:
         print(f"Webhook 监听于 http://{self.host}:{self.port}")
 
     async def _handle_webhook(self, request):
-        from aiohttp import web
-
         try:
-            data = await request.json()
+            data = await self._read_json(request)
 
             msg = IncomingMessage(
                 channel=self.name,
                 sender=data.get("sender", "unknown"),
                 content=data.get("message", ""),
                 group_id=data.get("group_id"),
-                metadata=data.get("metadata", {}),
+                metadata=data.get("metadata"),
             )
 
+            if data.get("stream") and self._on_message_stream:
+                return await self._stream_response(request, msg)
+
             response = await self._on_message(msg)
 
-            return web.json_response({"response": response})
+            return self._json_response({"response": response})
 
         except Exception as e:
-            return web.json_response({"error": str(e)}, status=500)
+            return self._json_response({"error": str(e)}, status=500)
 
-    async def _health(self, request):
-        from aiohttp import web
+    async def _read_json(self, request) -> Dict[str, Any]:
+        """读取请求体并解析 JSON，安装了 orjson 时使用它解码。"""
+        # request.read() 受 aiohttp 的 client_max_size 限制，过大的请求会被拒绝
+        body = await request.read()
+        if orjson is not None:
+            return orjson.loads(body)
+        return json.loads(body)
+
+    async def _stream_response(self, request, msg: IncomingMessage):
+        """
+        以 NDJSON 流式返回响应。
+
+        每行一个 JSON 对象: {"delta": "..."} 为增量文本，工具事件原样输出，
+        最后一行为 {"done": true}。
+        """
+        response = web.StreamResponse(
+            headers={"Content-Type": "application/x-ndjson"}
+        )
+        await response.prepare(request)
+
+        try:
+            async for chunk in self._on_message_stream(msg):
+                event = {"delta": chunk} if isinstance(chunk, str) else chunk
+                await response.write(self._json_line(event))
+            await response.write(self._json_line({"done": True}))
+        except Exception as e:
+            await response.write(self._json_line({"error": str(e)}))
+
+        await response.write_eof()
+        return response
+
+    def _json_line(self, data: Dict[str, Any]) -> bytes:
+        """编码一行 NDJSON。"""
+        if orjson is not None:
+            return orjson.dumps(data, option=orjson.OPT_APPEND_NEWLINE)
+        return (json.dumps(data, ensure_ascii=False) + "\n").encode("utf-8")
 
+    async def _health(self, request):
         return web.json_response({"status": "ok"})
 
+    def _json_response(self, data: Dict[str, Any], status: int = 200):
+        """构建 JSON 响应，安装了 orjson 时使用它编码。"""
+        if orjson is None:
+            return web.json_response(data, status=status)
+
+        return web.Response(
+            body=orjson.dumps(data), status=status, content_type="application/json"
+        )
+
     async def stop(self) -> None:
         if self._server:
             await self._server.stop()
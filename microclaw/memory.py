@@ -11,11 +11,65 @@ MicroClaw 的记忆系统遵循 OpenClaw 的纯 Markdown 方式:
 文件即记忆 - 模型只"记住"写入磁盘的内容。
 """
 
+import bisect
+import functools
+import heapq
+import io
+import itertools
+import json
+import os
 import re
+import stat
+import threading
+import warnings
+from array import array
+from collections import Counter, OrderedDict
 from dataclasses import dataclass, field
-from datetime import datetime, timedelta
+from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+try:
+    import yaml
+
+    # 有 libyaml 时使用 C 实现的 SafeLoader
+    _YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+except ImportError:
+    yaml = None
+    _YamlLoader = None
+
+
+# 技能名称: 小写字母、数字、连字符 (\Z 不接受结尾换行)
+_SKILL_NAME_RE = re.compile(r"^[a-z0-9-]{1,64}\Z")
+
+# Markdown 标题标记
+_MD_HEADING_RE = re.compile(r"^#+\s*")
+
+# 技能描述的 XML 转义表
+_XML_ESCAPE = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;"})
+
+
+def _decode_text(data) -> Optional[str]:
+    """按 UTF-8、GBK (Windows 兼容) 的顺序解码，换行符转换与 read_text 一致。"""
+    for encoding in ("utf-8", "gbk"):
+        try:
+            content = str(data, encoding)
+            break
+        except UnicodeDecodeError:
+            continue
+    else:
+        return None
+
+    if "\r" in content:
+        content = content.replace("\r\n", "\n").replace("\r", "\n")
+    return content
+
+
+@functools.lru_cache(maxsize=64)
+def _format_day(ordinal: int) -> str:
+    """将日期序数格式化为 YYYY-MM-DD (按日缓存，不经过 strftime)。"""
+    d = datetime.fromordinal(ordinal)
+    return f"{d.year:04d}-{d.month:02d}-{d.day:02d}"
 
 
 @dataclass
@@ -37,7 +91,7 @@ class SkillMetadata:
     def __post_init__(self):
         """校验字段格式。"""
         # 校验 name 格式: 小写字母、数字、连字符
-        if not re.match(r"^[a-z0-9-]{1,64}$", self.name):
+        if not _SKILL_NAME_RE.match(self.name):
             raise ValueError(
                 f"Skill name '{self.name}' must be 1-64 characters, "
                 "lowercase letters, numbers, and hyphens only"
@@ -103,6 +157,29 @@ class WorkspaceFiles:
         # 确保技能目录存在
         self.skills_dir.mkdir(parents=True, exist_ok=True)
 
+        # 文件内容 LRU 缓存: path -> (mtime_ns, size, content)
+        self._cache: "OrderedDict[Path, Tuple[int, int, Optional[str]]]" = (
+            OrderedDict()
+        )
+        # build_context 可能在多个工作线程中同时运行，缓存的增删需要加锁
+        self._cache_lock = threading.Lock()
+
+        # 技能缓存: SKILL.md path -> (mtime_ns, size, metadata, body)
+        # body 为 None 表示元数据来自磁盘索引，尚未读取文件
+        self._skill_cache: Dict[
+            Path, Tuple[int, int, SkillMetadata, Optional[str]]
+        ] = {}
+
+        # 磁盘技能索引 (首次使用时加载) 及是否需要重写
+        self._skills_index: Optional[Dict[str, Dict[str, Any]]] = None
+        self._skills_index_dirty = False
+
+        # 技能目录的真实路径: skill name -> resolved path
+        self._skill_roots: Dict[str, Path] = {}
+
+        # build_context 结果缓存: (路径, 文件内容, 技能指纹) -> 上下文
+        self._ctx_cache: Dict[tuple, str] = {}
+
     @property
     def memory_dir(self) -> Path:
         return self.workspace / self.config.daily_dir
@@ -136,23 +213,63 @@ class WorkspaceFiles:
     def daily_path(self, date: Optional[datetime] = None) -> Path:
         """获取每日记忆文件的路径。"""
         date = date or datetime.now()
-        filename = f"{date.strftime('%Y-%m-%d')}.md"
-        return self.memory_dir / filename
+        return self.memory_dir / f"{_format_day(date.toordinal())}.md"
 
     # === 读取操作 ===
 
+    # 超过此大小的文件通过 mmap 读取
+    MMAP_THRESHOLD = 1 << 20
+
+    # 内容缓存最多保留的文件数 (搜索索引按文件状态单独缓存，不受此上限影响)
+    CACHE_SIZE = 256
+
     def read_file(self, path: Path) -> Optional[str]:
-        """如果文件存在则读取。支持 UTF-8 和 GBK 编码。"""
-        if path.exists():
+        """
+        如果文件存在则读取。支持 UTF-8 和 GBK 编码。
+
+        内容按 (mtime_ns, size) 缓存，文件未变化时不再读取磁盘。
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            with self._cache_lock:
+                self._cache.pop(path, None)
+            return None
+
+        with self._cache_lock:
+            cached = self._cache.get(path)
+            if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+                self._cache.move_to_end(path)
+                return cached[2]
+
+        try:
+            if st.st_size >= self.MMAP_THRESHOLD:
+                content = self._read_mapped(path)
+            else:
+                # 只读一次磁盘，编码回退在内存中完成
+                content = _decode_text(path.read_bytes())
+        except OSError:
+            return None
+
+        with self._cache_lock:
+            self._cache[path] = (st.st_mtime_ns, st.st_size, content)
+            self._cache.move_to_end(path)
+            if len(self._cache) > self.CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return content
+
+    def _read_mapped(self, path: Path) -> Optional[str]:
+        """通过 mmap 直接解码大文件，省去中间的 bytes 副本。"""
+        import mmap
+
+        with open(path, "rb") as f:
             try:
-                return path.read_text(encoding="utf-8")
-            except UnicodeDecodeError:
-                # 尝试 GBK 编码 (Windows 兼容)
-                try:
-                    return path.read_text(encoding="gbk")
-                except UnicodeDecodeError:
-                    return None
-        return None
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # 检查大小之后文件被截断为空，空文件无法映射
+                return _decode_text(b"")
+            with mm:
+                return _decode_text(mm)
 
     def read_soul(self) -> Optional[str]:
         """读取 SOUL.md (Agent 人格)。"""
@@ -178,16 +295,33 @@ class WorkspaceFiles:
         """读取每日记忆文件。"""
         return self.read_file(self.daily_path(date))
 
-    def read_recent_daily(self, days: int = 2) -> Dict[str, str]:
-        """读取最近的每日文件 (今天 + 回溯)。"""
+    # 回溯天数超过此值时，先扫描一次目录，只读取存在的每日文件
+    DAILY_SCAN_THRESHOLD = 8
+
+    def _recent_days(self, days: int, date: Optional[datetime] = None) -> List[str]:
+        """最近 days 天的日期 (从 date 往前)，回溯较长时跳过不存在的文件。"""
+        today = (date or datetime.now()).toordinal()
+        recent = [_format_day(today - i) for i in range(days)]
+        if days <= self.DAILY_SCAN_THRESHOLD:
+            return recent
+
+        try:
+            with os.scandir(self.memory_dir) as it:
+                present = {entry.name for entry in it}
+        except OSError:
+            return []
+        return [day for day in recent if f"{day}.md" in present]
+
+    def read_recent_daily(
+        self, days: int = 2, date: Optional[datetime] = None
+    ) -> Dict[str, str]:
+        """读取最近的每日文件 (今天 + 回溯)。date 默认为当前时间。"""
         result = {}
-        today = datetime.now()
 
-        for i in range(days):
-            date = today - timedelta(days=i)
-            content = self.read_daily(date)
+        for day in self._recent_days(days, date):
+            content = self.read_file(self.memory_dir / f"{day}.md")
             if content:
-                result[date.strftime("%Y-%m-%d")] = content
+                result[day] = content
 
         return result
 
@@ -207,53 +341,161 @@ class WorkspaceFiles:
         返回 SkillMetadata 列表，每个约 100 tokens。
         """
         skills = []
-        if not self.skills_dir.exists():
+        try:
+            # scandir 的 DirEntry 自带类型信息，省去逐个 Path 的 stat 调用
+            with os.scandir(self.skills_dir) as it:
+                entries = sorted((e for e in it if e.is_dir()), key=lambda e: e.name)
+        except OSError:
             return skills
 
-        for skill_dir in sorted(self.skills_dir.iterdir()):
-            if skill_dir.is_dir():
-                skill_file = skill_dir / self.SKILL_FILE
-                if skill_file.exists():
-                    try:
-                        metadata = self._parse_skill_metadata(skill_file)
-                        skills.append(metadata)
-                    except ValueError as e:
-                        # 校验失败，记录警告但继续
-                        import warnings
-
-                        warnings.warn(f"Invalid skill {skill_dir.name}: {e}")
-                    except Exception as e:
-                        import warnings
+        for entry in entries:
+            skill_path = os.path.join(entry.path, self.SKILL_FILE)
+            if os.path.isfile(skill_path):
+                try:
+                    metadata = self._parse_skill_metadata(Path(skill_path))
+                    skills.append(metadata)
+                except ValueError as e:
+                    # 校验失败，记录警告但继续
+                    warnings.warn(f"Invalid skill {entry.name}: {e}")
+                except Exception as e:
+                    warnings.warn(f"Failed to parse skill {entry.name}: {e}")
 
-                        warnings.warn(f"Failed to parse skill {skill_dir.name}: {e}")
+        if self._skills_index_dirty:
+            self._write_skills_index(skills)
 
         return skills
 
+    # 技能元数据索引 (跨进程复用解析结果，按 SKILL.md 的 mtime/size 校验)
+    SKILLS_INDEX_FILE = ".index.json"
+
+    def _load_skills_index(self) -> Dict[str, Dict[str, Any]]:
+        """读取磁盘上的技能索引: 技能目录名 -> 记录。文件缺失或损坏时返回空。"""
+        if self._skills_index is None:
+            self._skills_index = {}
+            try:
+                with open(self.skills_dir / self.SKILLS_INDEX_FILE, "rb") as f:
+                    records = json.load(f)
+                self._skills_index = {r["dir"]: r for r in records}
+            except (OSError, ValueError, TypeError, KeyError):
+                pass
+        return self._skills_index
+
+    def _write_skills_index(self, skills: List[SkillMetadata]):
+        """将当前技能元数据写入索引，无法序列化的技能跳过。"""
+        index = {}
+        for metadata in skills:
+            cached = self._skill_cache.get(metadata.path)
+            if cached is None or cached[2] is not metadata:
+                continue
+            record = {
+                "dir": metadata.path.parent.name,
+                "mtime_ns": cached[0],
+                "size": cached[1],
+                "name": metadata.name,
+                "description": metadata.description,
+                "license": metadata.license,
+                "compatibility": metadata.compatibility,
+                "metadata": metadata.metadata,
+                "allowed_tools": metadata.allowed_tools,
+            }
+            try:
+                json.dumps(record)
+            except (TypeError, ValueError):
+                continue
+            index[record["dir"]] = record
+
+        try:
+            self.write_file(
+                self.skills_dir / self.SKILLS_INDEX_FILE,
+                json.dumps(list(index.values()), ensure_ascii=False),
+            )
+        except OSError:
+            return
+        self._skills_index = index
+        self._skills_index_dirty = False
+
     def _parse_skill_metadata(self, skill_file: Path) -> SkillMetadata:
         """
         解析 SKILL.md 文件，提取元数据。
 
         只解析 frontmatter，不加载 body 内容。
         校验 name 和 description 必需字段。
+        先查内存缓存，再查磁盘索引，都未命中时才读取并解析文件。
+        """
+        st = skill_file.stat()
+        cached = self._skill_cache.get(skill_file)
+        if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+            return cached[2]
+
+        record = self._load_skills_index().get(skill_file.parent.name)
+        if (
+            record
+            and record.get("mtime_ns") == st.st_mtime_ns
+            and record.get("size") == st.st_size
+        ):
+            try:
+                metadata = SkillMetadata(
+                    name=record["name"],
+                    description=record["description"],
+                    path=skill_file,
+                    license=record["license"],
+                    compatibility=record["compatibility"],
+                    metadata=record["metadata"],
+                    allowed_tools=record["allowed_tools"],
+                )
+            except (KeyError, TypeError, ValueError):
+                pass
+            else:
+                # body 未知，load_skill 时再读取文件
+                self._skill_cache[skill_file] = (
+                    st.st_mtime_ns,
+                    st.st_size,
+                    metadata,
+                    None,
+                )
+                return metadata
+
+        metadata = self._parse_skill_file(skill_file)[0]
+        self._skills_index_dirty = True
+        return metadata
+
+    def _parse_skill_file(self, skill_file: Path) -> Tuple[SkillMetadata, str]:
+        """
+        读取一次 SKILL.md，同时返回元数据和 body (不含 frontmatter)。
+
+        结果按 (mtime_ns, size) 缓存，文件未变化时不再读取和解析。
         """
+        st = skill_file.stat()
+        cached = self._skill_cache.get(skill_file)
+        if (
+            cached
+            and cached[0] == st.st_mtime_ns
+            and cached[1] == st.st_size
+            and cached[3] is not None
+        ):
+            return cached[2], cached[3]
+
         content = skill_file.read_text(encoding="utf-8")
 
         # 解析 YAML frontmatter
         frontmatter = {}
         body = content
+        skill_body = content
 
         if content.startswith("---"):
-            parts = content.split("---", 2)
-            if len(parts) >= 3:
-                try:
-                    import yaml
-
-                    frontmatter = yaml.safe_load(parts[1].strip()) or {}
-                    body = parts[2].strip()
-                except ImportError:
-                    pass
-                except Exception:
-                    pass
+            # 等价于 content.split("---", 2)，用 find 定位第二个分隔符直接切片
+            end = content.find("---", 3)
+            if end != -1:
+                skill_body = content[end + 3 :].strip()
+                if yaml is not None:
+                    try:
+                        frontmatter = (
+                            yaml.load(content[3:end].strip(), Loader=_YamlLoader)
+                            or {}
+                        )
+                        body = skill_body
+                    except Exception:
+                        pass
 
         # 提取必需字段
         name = frontmatter.get("name") or skill_file.parent.name
@@ -263,10 +505,10 @@ class WorkspaceFiles:
         if not description and body:
             first_line = body.split("\n")[0].strip()
             # 移除 markdown 标题标记
-            description = re.sub(r"^#+\s*", "", first_line)[:1024]
+            description = _MD_HEADING_RE.sub("", first_line)[:1024]
 
         # 创建元数据对象 (会在 __post_init__ 中校验)
-        return SkillMetadata(
+        metadata = SkillMetadata(
             name=name,
             description=description,
             path=skill_file,
@@ -275,6 +517,13 @@ class WorkspaceFiles:
             metadata=frontmatter.get("metadata", {}),
             allowed_tools=frontmatter.get("allowed-tools", []),
         )
+        self._skill_cache[skill_file] = (
+            st.st_mtime_ns,
+            st.st_size,
+            metadata,
+            skill_body,
+        )
+        return metadata, skill_body
 
     def load_skill(self, name: str) -> Optional[Skill]:
         """
@@ -293,15 +542,7 @@ class WorkspaceFiles:
             return None
 
         try:
-            metadata = self._parse_skill_metadata(skill_file)
-
-            # 读取完整 body 内容
-            content = skill_file.read_text(encoding="utf-8")
-            body = content
-            if content.startswith("---"):
-                parts = content.split("---", 2)
-                if len(parts) >= 3:
-                    body = parts[2].strip()
+            metadata, body = self._parse_skill_file(skill_file)
 
             return Skill(
                 name=metadata.name,
@@ -333,13 +574,20 @@ class WorkspaceFiles:
         skill_dir = self.skills_dir / skill_name
         resource_dir = skill_dir / category
 
-        if not resource_dir.exists():
-            return []
-
+        # 用 scandir 遍历 (与 rglob 一致: 不进入符号链接目录，忽略无法读取的目录)
+        prefix = len(str(skill_dir)) + 1
         resources = []
-        for f in resource_dir.rglob("*"):
-            if f.is_file():
-                resources.append(str(f.relative_to(skill_dir)))
+        pending = [str(resource_dir)]
+        while pending:
+            try:
+                with os.scandir(pending.pop()) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            pending.append(entry.path)
+                        elif entry.is_file():
+                            resources.append(entry.path[prefix:])
+            except OSError:
+                continue
 
         return sorted(resources)
 
@@ -357,15 +605,23 @@ class WorkspaceFiles:
         skill_dir = self.skills_dir / skill_name
         resource_file = skill_dir / resource_path
 
-        # 安全检查: 确保路径在技能目录内
-        try:
-            resource_file.resolve().relative_to(skill_dir.resolve())
-        except ValueError:
-            return None
+        # 技能目录的真实路径只解析一次
+        skill_root = self._skill_roots.get(skill_name)
+        if skill_root is None:
+            skill_root = skill_dir.resolve()
+            # 只缓存 skills/ 下真实存在的技能，LLM 编造的名称不会撑大缓存
+            if (
+                skill_dir.parent == self.skills_dir
+                and skill_name != ".."
+                and skill_root.is_dir()
+            ):
+                self._skill_roots[skill_name] = skill_root
 
-        if not resource_file.exists():
+        # 安全检查: 确保路径在技能目录内
+        if not resource_file.resolve().is_relative_to(skill_root):
             return None
 
+        # 文件不存在时 read_file 返回 None
         return self.read_file(resource_file)
 
     # === 向后兼容 (已弃用) ===
@@ -376,8 +632,6 @@ class WorkspaceFiles:
 
         列出工作区中所有可用的技能。
         """
-        import warnings
-
         warnings.warn(
             "list_skills() is deprecated, use list_skills_metadata() instead",
             DeprecationWarning,
@@ -410,16 +664,44 @@ class WorkspaceFiles:
         """
         skill = self.load_skill(name)
         if skill:
-            # 返回完整文件内容 (包含 frontmatter)
-            return skill.path.read_text(encoding="utf-8")
+            # 返回完整文件内容 (包含 frontmatter)，经内容缓存读取
+            return self.read_file(skill.path)
         return None
 
     # === 写入操作 ===
 
     def write_file(self, path: Path, content: str):
-        """将内容写入文件。"""
-        path.parent.mkdir(parents=True, exist_ok=True)
-        path.write_text(content, encoding="utf-8")
+        """
+        将内容写入文件。
+
+        先写入同目录的临时文件再原子替换，崩溃时不会留下写了一半的文件。
+        """
+        with self._cache_lock:
+            self._cache.pop(path, None)
+
+        # 写入符号链接指向的真实文件，保留链接本身
+        target = Path(os.path.realpath(path))
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp = target.with_name(
+            f".{target.name}.{os.getpid()}.{threading.get_ident()}.tmp"
+        )
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(content)
+                f.flush()
+                os.fsync(f.fileno())
+            try:
+                # 保留原文件的权限
+                os.chmod(tmp, stat.S_IMODE(os.stat(target).st_mode))
+            except OSError:
+                pass
+            os.replace(tmp, target)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
 
     def write_soul(self, content: str):
         """写入 SOUL.md。"""
@@ -440,12 +722,17 @@ class WorkspaceFiles:
     def append_daily(self, content: str, date: Optional[datetime] = None):
         """追加到今天的每日记忆文件。"""
         path = self.daily_path(date)
-        existing = self.read_file(path) or ""
-
-        if existing and not existing.endswith("\n"):
-            existing += "\n"
+        path.parent.mkdir(parents=True, exist_ok=True)
 
-        self.write_file(path, existing + content)
+        # 以追加模式写入，只检查最后一个字节，不再读回整个文件
+        with self._cache_lock:
+            self._cache.pop(path, None)
+        with open(path, "ab+") as f:
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    f.write(b"\n")
+            f.write(content.encode("utf-8"))
 
     # === 技能 XML 生成 (Progressive Disclosure) ===
 
@@ -462,12 +749,8 @@ class WorkspaceFiles:
 
         lines = ["<available_skills>"]
         for skill in skills:
-            # XML 转义
-            desc = (
-                skill.description.replace("&", "&amp;")
-                .replace("<", "&lt;")
-                .replace(">", "&gt;")
-            )
+            # XML 转义 (单次遍历)
+            desc = skill.description.translate(_XML_ESCAPE)
             lines.append(f"""  <skill>
     <name>{skill.name}</name>
     <description>{desc}</description>
@@ -478,64 +761,108 @@ class WorkspaceFiles:
 
     # === 上下文构建 ===
 
-    def build_context(self, is_main_session: bool = True) -> str:
+    def build_context(
+        self, is_main_session: bool = True, date: Optional[datetime] = None
+    ) -> str:
         """
         构建工作区上下文以注入系统提示。
 
         参数:
             is_main_session: 如果为 True，包含 MEMORY.md。如果为 False (群聊)，
                            出于隐私考虑排除它。
+            date: 作为"今天"的时间，决定读取哪些每日笔记 (默认当前时间)。
 
         技能使用 Progressive Disclosure 模式:
         - 只注入 <available_skills> XML (name + description)
         - LLM 可根据需要调用 load_skill() 激活特定技能
         """
-        sections = []
-
-        # AGENTS.md - 工作区说明
-        agents = self.read_agents()
-        if agents:
-            sections.append(f"## AGENTS.md\n{agents}")
-
-        # SOUL.md - 人格
-        soul = self.read_soul()
-        if soul:
-            sections.append(f"## SOUL.md\n{soul}")
-
-        # USER.md - 用户上下文
-        user = self.read_user()
-        if user:
-            sections.append(f"## USER.md\n{user}")
-
-        # MEMORY.md - 长期记忆 (仅主会话)
+        titles = ["AGENTS.md", "SOUL.md", "USER.md"]
+        paths = [self.agents_path, self.soul_path, self.user_path]
         if is_main_session:
-            memory = self.read_memory()
-            if memory:
-                sections.append(f"## MEMORY.md\n{memory}")
-
-        # TOOLS.md - 本地工具说明
-        tools = self.read_tools()
-        if tools:
-            sections.append(f"## TOOLS.md\n{tools}")
+            titles.append("MEMORY.md")
+            paths.append(self.memory_path)
+        titles.append("TOOLS.md")
+        paths.append(self.tools_path)
+
+        days = self._recent_days(self.config.daily_lookback, date)
+        paths.extend(self.memory_dir / f"{day}.md" for day in days)
+
+        contents = tuple(self.read_file(p) for p in paths)
+
+        # 组成文件和技能都未变化时直接返回上次的结果
+        # (read_file 对未变化的文件返回同一对象，比较开销很小)
+        skills_key = self._skills_signature() if self.config.load_skills else None
+        key = (tuple(paths), contents, skills_key)
+        cached = self._ctx_cache.get(key)
+        if cached is not None:
+            return cached
+
+        out = io.StringIO()
+        out.write("# 工作区上下文\n\n")
+        empty = out.tell()
+
+        # 逐段写入缓冲区，避免为每个段落拼接中间字符串
+        def begin(title: str):
+            if out.tell() != empty:
+                out.write("\n\n")
+            out.write("## ")
+            out.write(title)
+            out.write("\n")
+
+        def section(title: str, body: Optional[str]):
+            if body:
+                begin(title)
+                out.write(body)
+
+        # AGENTS.md, SOUL.md, USER.md, MEMORY.md (仅主会话), TOOLS.md
+        for title, body in zip(titles, contents):
+            section(title, body)
 
         # 技能 - Progressive Disclosure (只注入 available_skills XML)
         if self.config.load_skills:
-            skills_xml = self.build_available_skills_xml()
-            if skills_xml:
-                sections.append(f"## 可用技能\n{skills_xml}")
+            section("可用技能", self.build_available_skills_xml())
 
-        # 最近的每日笔记
-        daily = self.read_recent_daily(self.config.daily_lookback)
+        # 最近的每日笔记 (从今天往前)
+        daily = [(day, c) for day, c in zip(days, contents[len(titles) :]) if c]
         if daily:
-            daily_content = []
-            for date, content in sorted(daily.items(), reverse=True):
-                daily_content.append(f"### {date}\n{content}")
-            sections.append("## 最近笔记\n" + "\n\n".join(daily_content))
+            begin("最近笔记")
+            first = True
+            for day, content in daily:
+                if not first:
+                    out.write("\n\n")
+                first = False
+                out.write("### ")
+                out.write(day)
+                out.write("\n")
+                out.write(content)
+
+        result = out.getvalue() if out.tell() != empty else ""
+
+        # build_context 可能在多个线程中同时运行，淘汰和写入需要加锁
+        with self._cache_lock:
+            if len(self._ctx_cache) >= self.CONTEXT_CACHE_SIZE:
+                self._ctx_cache.pop(next(iter(self._ctx_cache)), None)
+            self._ctx_cache[key] = result
+        return result
 
-        if not sections:
-            return ""
+    # build_context 结果缓存的条目数 (主会话 / 群聊各占一条)
+    CONTEXT_CACHE_SIZE = 4
 
-        return "# 工作区上下文\n\n" + "\n\n".join(sections)
+    def _skills_signature(self) -> tuple:
+        """各技能 SKILL.md 的 (名称, mtime_ns, size) 指纹，用于判断技能是否变化。"""
+        try:
+            entries = sorted(os.scandir(self.skills_dir), key=lambda e: e.name)
+        except OSError:
+            return ()
+
+        signature = []
+        for entry in entries:
+            try:
+                st = os.stat(os.path.join(entry.path, self.SKILL_FILE))
+            except OSError:
+                continue
+            signature.append((entry.name, st.st_mtime_ns, st.st_size))
+        return tuple(signature)
 
     # === 初始化默认文件 ===
 
@@ -563,6 +890,95 @@ class WorkspaceFiles:
 # === 记忆搜索 (简单实现) ===
 
 
+@dataclass
+class _LineIndex:
+    """
+    单个记忆文件的倒排索引: 空白分隔的小写词 -> 所在行号。
+
+    查询词本身不含空白，所以"查询词是某行的子串"等价于
+    "查询词是该行某个词的子串"，按词表查找即可保持原有的子串匹配语义。
+    """
+
+    content: str
+    postings: Dict[str, List[int]]
+    vocab: str  # 所有词以换行连接，用于子串查找
+    starts: List[int]  # 每个词在 vocab 中的起始偏移
+    tokens: List[str]
+    chars: FrozenSet[str]  # 文件中出现过的字符，用于快速排除不可能命中的词
+    line_starts: "array[int]"  # 每行在原文中的起始偏移，按需切出片段
+    memo: Dict[str, Tuple[int, ...]] = field(default_factory=dict)
+
+    @classmethod
+    def build(cls, content: str) -> "_LineIndex":
+        postings: Dict[str, List[int]] = {}
+        line_starts = array("q")
+        offset = 0
+        for i, line in enumerate(content.split("\n")):
+            line_starts.append(offset)
+            offset += len(line) + 1
+            for token in set(line.lower().split()):
+                lines = postings.get(token)
+                if lines is None:
+                    postings[token] = [i]
+                else:
+                    lines.append(i)
+
+        tokens = list(postings)
+        starts = []
+        offset = 0
+        for token in tokens:
+            starts.append(offset)
+            offset += len(token) + 1
+        vocab = "\n".join(tokens)
+        return cls(
+            content, postings, vocab, starts, tokens, frozenset(vocab), line_starts
+        )
+
+    def lookup(self, word: str) -> Tuple[int, ...]:
+        """返回包含 word (子串) 的行号，结果按词缓存。"""
+        found = self.memo.get(word)
+        if found is not None:
+            return found
+
+        # 含有文件中不存在的字符时不可能是子串，无需扫描词表
+        if not self.chars.issuperset(word):
+            self.memo[word] = ()
+            return ()
+
+        lines = set()
+        vocab = self.vocab
+        pos = vocab.find(word)
+        while pos != -1:
+            k = bisect.bisect_right(self.starts, pos) - 1
+            lines.update(self.postings[self.tokens[k]])
+            # 同一个词只需命中一次，直接跳到下一个词
+            if k + 1 >= len(self.starts):
+                break
+            pos = vocab.find(word, self.starts[k + 1])
+
+        found = self.memo[word] = tuple(lines)
+        return found
+
+    def text(self, start: int, end: int, limit: Optional[int] = None) -> str:
+        """
+        返回第 start 到 end 行 (不含) 的原文，与按行拆分后切片再拼接的结果相同。
+
+        limit 限制返回的字符数，超长行不会被整体复制。
+        """
+        start, end, _ = slice(start, end).indices(len(self.line_starts))
+        if start >= end:
+            return ""
+
+        a = self.line_starts[start]
+        if end < len(self.line_starts):
+            b = self.line_starts[end] - 1
+        else:
+            b = len(self.content)
+        if limit is not None:
+            b = min(b, a + limit)
+        return self.content[a:b]
+
+
 class MemorySearch:
     """
     简单的记忆搜索实现。
@@ -571,59 +987,140 @@ class MemorySearch:
     此实现使用基本的关键词匹配。
     """
 
+    # 查询时忽略的常见虚词
+    STOPWORDS = frozenset(
+        "a an and are is of or the to in on 的 了 是 在 和 我 吗 呢 吧 啊".split()
+    )
+
     def __init__(self, workspace: WorkspaceFiles):
         self.workspace = workspace
 
+        # 倒排索引缓存: path -> (mtime_ns, size, _LineIndex)
+        # 按文件状态判断是否有效，不依赖 read_file 的内容缓存是否仍保留该文件
+        self._indexes: Dict[Path, Tuple[int, int, _LineIndex]] = {}
+
+    def _cached_index(
+        self, path: Path
+    ) -> Tuple[Optional[os.stat_result], Optional["_LineIndex"]]:
+        """返回 (文件状态, 仍有效的缓存索引或 None)；文件不存在时状态为 None。"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            self._indexes.pop(path, None)
+            return None, None
+
+        cached = self._indexes.get(path)
+        if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+            return st, cached[2]
+        return st, None
+
+    def _index_for(self, path: Path) -> Optional["_LineIndex"]:
+        """返回文件的倒排索引，文件未变化时复用缓存而不重新读取。"""
+        st, index = self._cached_index(path)
+        if st is None or index is not None:
+            return index
+
+        content = self.workspace.read_file(path)
+        if content is None:
+            self._indexes.pop(path, None)
+            return None
+
+        index = _LineIndex.build(content)
+        self._indexes[path] = (st.st_mtime_ns, st.st_size, index)
+        return index
+
+    def _read_lines(self, path: Path, start: int, end: int) -> Optional[str]:
+        """返回文件第 start 到 end 行 (不含) 的原文，索引仍有效时按偏移切片。"""
+        st, index = self._cached_index(path)
+        if st is None:
+            return None
+        if index is not None:
+            return index.text(start, end)
+
+        content = self.workspace.read_file(path)
+        if content is None:
+            return None
+
+        # 只需拆分到片段结束的位置，大文件不必整体拆分
+        return "\n".join(content.split("\n", end)[start:end])
+
     def search(self, query: str, max_results: int = 5) -> List[Dict[str, Any]]:
         """
         在记忆文件中搜索相关内容。
 
         返回带有文件路径和行号的片段。
         """
-        results = []
-        query_lower = query.lower()
-        query_words = set(query_lower.split())
+        query_words = set(query.lower().split())
+        if not query_words:
+            return []
+
+        # 去掉停用词，它们几乎命中每一行，只会稀释评分
+        # (查询只由停用词组成时保留原样)
+        query_words = (query_words - self.STOPWORDS) or query_words
 
         # 要搜索的文件
         files_to_search = [
             (self.workspace.memory_path, "MEMORY.md"),
         ]
 
-        # 添加每日文件
-        for path in self.workspace.memory_dir.glob("*.md"):
-            files_to_search.append((path, f"memory/{path.name}"))
-
-        for path, label in files_to_search:
-            if not path.exists():
-                continue
-
-            content = path.read_text(encoding="utf-8")
-            lines = content.split("\n")
+        # 添加每日文件 (scandir 比 Path.glob 少构造 Path 对象和 stat 调用)
+        try:
+            with os.scandir(self.workspace.memory_dir) as it:
+                files_to_search.extend(
+                    (Path(entry.path), f"memory/{entry.name}")
+                    for entry in it
+                    if entry.name.endswith(".md") and entry.is_file()
+                )
+        except OSError:
+            pass
+
+        # 索引按文件增量维护: 未变化的文件复用原索引，只丢弃已删除文件的索引
+        live = {path for path, _ in files_to_search}
+        for path in [p for p in self._indexes if p not in live]:
+            del self._indexes[path]
+
+        indexed = []
+
+        def hits():
+            """逐个文件产出候选结果 (score, 文件序号, 行号)，不保存完整列表。"""
+            for path, label in files_to_search:
+                index = self._index_for(path)
+                if index is None:
+                    continue
+
+                file_idx = len(indexed)
+                indexed.append((label, index))
+
+                # 只对包含查询词的行计分 (Counter 在 C 层完成计数)
+                scores = Counter(
+                    itertools.chain.from_iterable(
+                        index.lookup(w) for w in query_words
+                    )
+                )
+                for i in sorted(scores):
+                    yield scores[i], file_idx, i
 
-            for i, line in enumerate(lines):
-                line_lower = line.lower()
+        # 按分数取前 N 个 (稳定，同分保持文件和行的顺序)，只保留 N 个候选
+        top = heapq.nlargest(max_results, hits(), key=lambda c: c[0])
 
-                # 基于词语匹配评分
-                score = sum(1 for word in query_words if word in line_lower)
+        # 只为最终结果构建片段
+        results = []
+        for score, file_idx, i in top:
+            label, index = indexed[file_idx]
 
-                if score > 0:
-                    # 获取上下文 (周围行)
-                    start = max(0, i - 1)
-                    end = min(len(lines), i + 2)
-                    snippet = "\n".join(lines[start:end])
+            # 获取上下文 (周围行)，直接按行偏移从原文切片
+            snippet = index.text(max(0, i - 1), i + 2, limit=500)
 
-                    results.append(
-                        {
-                            "path": label,
-                            "line": i + 1,
-                            "snippet": snippet[:500],
-                            "score": score,
-                        }
-                    )
+            results.append(
+                {
+                    "path": label,
+                    "line": i + 1,
+                    "snippet": snippet,
+                    "score": score,
+                }
+            )
 
-        # 按分数排序并限制数量
-        results.sort(key=lambda x: x["score"], reverse=True)
-        return results[:max_results]
+        return results
 
     def get_snippet(
         self, path: str, from_line: int = 1, lines: int = 20
@@ -636,16 +1133,8 @@ class MemorySearch:
         else:
             return None
 
-        if not full_path.exists():
-            return None
-
-        content = full_path.read_text(encoding="utf-8")
-        all_lines = content.split("\n")
-
         start = max(0, from_line - 1)
-        end = min(len(all_lines), start + lines)
-
-        return "\n".join(all_lines[start:end])
+        return self._read_lines(full_path, start, start + lines)
 
 
 # === 记忆工具 (供 Agent 使用) ===
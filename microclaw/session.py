@@ -9,12 +9,28 @@ MicroClaw 的会话设计参考了 OpenClaw:
 - JSONL 转录: 追加式日志记录完整历史
 """
 
+import asyncio
+import bisect
+import functools
 import json
+import os
+import secrets
+import shutil
+import sys
+from collections import OrderedDict, deque
 from dataclasses import dataclass, field
 from datetime import datetime, timedelta
 from enum import Enum
 from pathlib import Path
-from typing import Any, Dict, List, Literal, Optional
+from typing import Any, Callable, Dict, Iterator, List, Literal, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:  # 可选依赖，未安装时使用标准库 json
+    orjson = None
+
+# 解码 JSON (str 或 bytes)，安装了 orjson 时使用它
+_json_loads = orjson.loads if orjson is not None else json.loads
 
 # === 消息类型 ===
 
@@ -27,7 +43,7 @@ class MessageRole(str, Enum):
     COMPACTION = "compaction"  # 特殊: 压缩后的摘要
 
 
-@dataclass
+@dataclass(slots=True)
 class Message:
     """对话中的单条消息。"""
 
@@ -38,13 +54,21 @@ class Message:
     tool_call_id: Optional[str] = None
     tool_calls: Optional[List[Dict]] = None
     metadata: Dict[str, Any] = field(default_factory=dict)
+    token_count: Optional[int] = None  # 缓存的 token 估算值，只计算一次
+    # 缓存的 OpenAI 格式字典；消息加入会话后不再修改，无需失效
+    _openai: Optional[Dict[str, Any]] = field(
+        default=None, init=False, repr=False, compare=False
+    )
+
+    def __post_init__(self):
+        # 构造时统一为 MessageRole，序列化时无需再检查类型
+        if not isinstance(self.role, MessageRole):
+            self.role = MessageRole(self.role)
 
     def to_dict(self) -> Dict[str, Any]:
         """序列化为 JSONL 存储。"""
         data = {
-            "role": (
-                self.role.value if isinstance(self.role, MessageRole) else self.role
-            ),
+            "role": self.role.value,
             "content": self.content,
             "timestamp": self.timestamp.isoformat(),
         }
@@ -56,16 +80,15 @@ class Message:
             data["tool_calls"] = self.tool_calls
         if self.metadata:
             data["metadata"] = self.metadata
+        if self.token_count is not None:
+            data["token_count"] = self.token_count
         return data
 
     @classmethod
     def from_dict(cls, data: Dict[str, Any]) -> "Message":
         """从存储反序列化。"""
-        role = data["role"]
-        if isinstance(role, str):
-            role = MessageRole(role)
         return cls(
-            role=role,
+            role=data["role"],
             content=data["content"],
             timestamp=(
                 datetime.fromisoformat(data["timestamp"])
@@ -76,13 +99,17 @@ class Message:
             tool_call_id=data.get("tool_call_id"),
             tool_calls=data.get("tool_calls"),
             metadata=data.get("metadata", {}),
+            token_count=data.get("token_count"),
         )
 
     def to_openai(self) -> Dict[str, Any]:
-        """转换为 OpenAI 消息格式。"""
-        msg = {
-            "role": self.role.value if isinstance(self.role, MessageRole) else self.role
-        }
+        """转换为 OpenAI 消息格式 (首次构建后缓存)。"""
+        if self._openai is None:
+            self._openai = self._build_openai()
+        return self._openai
+
+    def _build_openai(self) -> Dict[str, Any]:
+        msg = {"role": self.role.value}
 
         # 处理压缩摘要
         if self.role == MessageRole.COMPACTION:
@@ -105,7 +132,7 @@ class Message:
 # === 会话键工具 ===
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class SessionKey:
     """
     遵循 OpenClaw 规范的结构化会话键。
@@ -124,9 +151,19 @@ class SessionKey:
     identifier: Optional[str] = None
     channel: Optional[str] = None
 
+    def __post_init__(self):
+        # 驻留键字符串，缓存字典中的查找可以直接按身份比较
+        object.__setattr__(self, "raw", sys.intern(self.raw))
+
     @classmethod
     def parse(cls, key: str) -> "SessionKey":
-        """解析会话键字符串。"""
+        """解析会话键字符串。SessionKey 不可变，相同的键复用缓存的解析结果。"""
+        if cls is SessionKey:
+            return _parse_key(key)
+        return cls._parse(key)
+
+    @classmethod
+    def _parse(cls, key: str) -> "SessionKey":
         parts = key.split(":")
 
         if parts[0] == "agent" and len(parts) >= 3:
@@ -184,10 +221,15 @@ class SessionKey:
         return self.raw
 
 
+@functools.lru_cache(maxsize=4096)
+def _parse_key(key: str) -> SessionKey:
+    return SessionKey._parse(key)
+
+
 # === 重置策略 ===
 
 
-@dataclass
+@dataclass(slots=True)
 class ResetPolicy:
     """
     会话重置策略 (OpenClaw 风格)。
@@ -202,19 +244,36 @@ class ResetPolicy:
     at_hour: int = 4  # 每日重置的小时 (0-23, 本地时间)
     idle_minutes: Optional[int] = None
 
+    # 缓存 (at_hour, 最近的重置时间, 下一次重置时间)，同一区间内无需重新计算
+    _reset_window: Optional[tuple] = field(
+        default=None, init=False, repr=False, compare=False
+    )
+
+    def _last_reset(self, now: datetime) -> datetime:
+        """返回 now 之前最近的一次每日重置时间。"""
+        window = self._reset_window
+        if (
+            window is not None
+            and window[0] == self.at_hour
+            and window[1] <= now < window[2]
+        ):
+            return window[1]
+
+        reset_today = now.replace(hour=self.at_hour, minute=0, second=0, microsecond=0)
+        if now < reset_today:
+            reset_today -= timedelta(days=1)
+        self._reset_window = (
+            self.at_hour, reset_today, reset_today + timedelta(days=1)
+        )
+        return reset_today
+
     def is_expired(self, last_update: datetime, now: Optional[datetime] = None) -> bool:
         """检查会话是否应该重置。"""
         now = now or datetime.now()
 
         if self.mode in ("daily", "both"):
             # 找到最近的重置时间
-            reset_today = now.replace(
-                hour=self.at_hour, minute=0, second=0, microsecond=0
-            )
-            if now < reset_today:
-                reset_today -= timedelta(days=1)
-
-            if last_update < reset_today:
+            if last_update < self._last_reset(now):
                 return True
 
         if self.mode in ("idle", "both") and self.idle_minutes:
@@ -228,7 +287,12 @@ class ResetPolicy:
 # === 会话 ===
 
 
-@dataclass
+def estimate_tokens(text: str) -> int:
+    """粗略估算文本的 token 数 (约 4 字节 1 个 token)，用于压缩决策。"""
+    return len(text.encode("utf-8")) // 4 + 1
+
+
+@dataclass(slots=True)
 class Session:
     """
     具有 OpenClaw 风格特性的对话会话。
@@ -264,10 +328,37 @@ class Session:
     # 状态 (任意会话范围的数据)
     state: Dict[str, Any] = field(default_factory=dict)
 
+    # Token 估算器 (文本 -> token 数)，每条消息只调用一次
+    token_estimator: Optional[Callable[[str], int]] = field(
+        default=None, repr=False, compare=False
+    )
+    # 当前消息的估算 token 总数，随消息增加和压缩增量维护
+    message_tokens: int = field(default=0, init=False)
+    # 已添加但尚未写入转录文件的消息，由 SessionStore.save 批量写入
+    _pending: List[Message] = field(
+        default_factory=list, init=False, repr=False, compare=False
+    )
+
+    def __post_init__(self):
+        self.message_tokens = sum(self.count_tokens(m) for m in self.messages)
+
+    def set_token_estimator(self, estimator: Optional[Callable[[str], int]]):
+        """设置 token 估算器，并按它重新计算当前消息的总数。"""
+        self.token_estimator = estimator
+        self.message_tokens = sum(self.count_tokens(m) for m in self.messages)
+
+    def count_tokens(self, message: Message) -> int:
+        """返回消息的 token 估算值，首次计算后缓存在消息上。"""
+        if message.token_count is None and self.token_estimator:
+            message.token_count = self.token_estimator(message.content)
+        return message.token_count or 0
+
     def add_message(self, role: MessageRole, content: str, **kwargs) -> Message:
         """向会话添加消息。"""
         msg = Message(role=role, content=content, **kwargs)
         self.messages.append(msg)
+        self._pending.append(msg)
+        self.message_tokens += self.count_tokens(msg)
         self.updated_at = datetime.now()
         return msg
 
@@ -288,17 +379,13 @@ class Session:
         self, system_prompt: Optional[str] = None, max_messages: Optional[int] = None
     ) -> List[Dict]:
         """获取格式化为 LLM API 的消息。"""
-        result = []
-
-        if system_prompt:
-            result.append({"role": "system", "content": system_prompt})
-
         messages = self.messages
         if max_messages:
             messages = messages[-max_messages:]
 
-        for msg in messages:
-            result.append(msg.to_openai())
+        result = [msg.to_openai() for msg in messages]
+        if system_prompt:
+            result.insert(0, {"role": "system", "content": system_prompt})
 
         return result
 
@@ -328,7 +415,10 @@ class Session:
 
     @classmethod
     def from_dict(
-        cls, data: Dict[str, Any], messages: List[Message] = None
+        cls,
+        data: Dict[str, Any],
+        messages: List[Message] = None,
+        token_estimator: Optional[Callable[[str], int]] = None,
     ) -> "Session":
         """反序列化会话。"""
         return cls(
@@ -348,6 +438,7 @@ class Session:
             ),
             origin=data.get("origin", {}),
             state=data.get("state", {}),
+            token_estimator=token_estimator,
         )
 
 
@@ -359,19 +450,45 @@ class SessionStore:
     OpenClaw 风格的会话存储。
 
     结构:
-    - sessions.json: 所有会话的元数据
+    - sessions.json: 所有会话的元数据快照
+    - sessions.wal.jsonl: 快照之后的元数据变更日志 (追加写入，定期合并回快照)
     - <session_id>.jsonl: 每个会话的消息转录
+    - <session_id>.jsonl.gz: 被重置替换的旧会话转录 (压缩归档)
     """
 
-    def __init__(self, storage_dir: str, reset_policy: Optional[ResetPolicy] = None):
+    # 变更日志超过 max(此值, 2 × 会话数) 条后合并回 sessions.json
+    METADATA_COMPACT_THRESHOLD = 256
+    # 内存中最多缓存的会话数 (LRU)，淘汰的会话需要时再从磁盘加载
+    MAX_CACHED_SESSIONS = 1024
+    # 从文件末尾向前读取转录时每次读取的字节数
+    TAIL_BLOCK_SIZE = 1 << 16
+
+    def __init__(
+        self,
+        storage_dir: str,
+        reset_policy: Optional[ResetPolicy] = None,
+        max_cached_sessions: Optional[int] = None,
+        token_estimator: Optional[Callable[[str], int]] = None,
+        max_loaded_messages: Optional[int] = None,
+    ):
         self.storage_dir = Path(storage_dir)
         self.storage_dir.mkdir(parents=True, exist_ok=True)
 
         self.reset_policy = reset_policy or ResetPolicy()
+        self.max_cached_sessions = max_cached_sessions or self.MAX_CACHED_SESSIONS
+        # 传给此存储创建和加载的每个会话，供 Compactor.should_compact 使用
+        self.token_estimator = token_estimator
+        # 从磁盘加载会话时最多读取的消息数 (只读转录末尾)，None 表示全部
+        self.max_loaded_messages = max_loaded_messages
 
         # 内存缓存
-        self._sessions: Dict[str, Session] = {}
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
         self._metadata: Dict[str, Dict] = {}
+        # 按 updated_at 升序排列的 (updated_at, key)，list() 无需解析和排序
+        self._by_updated: List[Tuple[str, str]] = []
+        self._wal_entries = 0
+        # 在线程中进行的转录归档，wait_archives() 等待其完成
+        self._archives: set = set()
 
         # 加载现有会话
         self._load_metadata()
@@ -380,52 +497,187 @@ class SessionStore:
     def _metadata_path(self) -> Path:
         return self.storage_dir / "sessions.json"
 
+    @property
+    def _wal_path(self) -> Path:
+        return self.storage_dir / "sessions.wal.jsonl"
+
     def _transcript_path(self, session_id: str) -> Path:
         return self.storage_dir / f"{session_id}.jsonl"
 
+    def _archive_path(self, session_id: str) -> Path:
+        return self.storage_dir / f"{session_id}.jsonl.gz"
+
     def _load_metadata(self):
-        """从 sessions.json 加载会话元数据。"""
+        """从 sessions.json 加载会话元数据，再重放变更日志。"""
         if self._metadata_path.exists():
             try:
-                with open(self._metadata_path, "r", encoding="utf-8") as f:
-                    self._metadata = json.load(f)
+                self._metadata = _json_loads(self._metadata_path.read_bytes())
             except Exception:
                 self._metadata = {}
 
-    def _save_metadata(self):
-        """保存会话元数据到 sessions.json。"""
-        with open(self._metadata_path, "w", encoding="utf-8") as f:
-            json.dump(self._metadata, f, indent=2, ensure_ascii=False)
+        if self._wal_path.exists() and self._wal_path.stat().st_size:
+            with open(self._wal_path, "rb") as f:
+                for line in f:
+                    try:
+                        entry = _json_loads(line)
+                    except ValueError:
+                        # 崩溃时可能留下写了一半的最后一行
+                        continue
+                    if entry.get("meta") is None:
+                        self._metadata.pop(entry["key"], None)
+                    else:
+                        self._metadata[entry["key"]] = entry["meta"]
+            # 合并后从空日志开始，残缺的行不会和后续追加的记录粘连
+            self._compact_metadata()
+
+        self._by_updated = sorted(
+            (meta["updated_at"], key) for key, meta in self._metadata.items()
+        )
+
+    def _save_metadata(self, key_str: str, meta: Optional[Dict]):
+        """
+        更新一个会话的元数据 (meta 为 None 表示删除)。
 
-    def _load_transcript(self, session_id: str) -> List[Message]:
-        """从 JSONL 转录文件加载消息。"""
-        messages = []
-        path = self._transcript_path(session_id)
+        同步维护 updated_at 排序索引，并把变更追加到变更日志。
+        """
+        old = self._metadata.get(key_str)
+        if old is not None:
+            entry = (old["updated_at"], key_str)
+            i = bisect.bisect_left(self._by_updated, entry)
+            if i < len(self._by_updated) and self._by_updated[i] == entry:
+                del self._by_updated[i]
+        if meta is None:
+            self._metadata.pop(key_str, None)
+        else:
+            self._metadata[key_str] = meta
+            bisect.insort(self._by_updated, (meta["updated_at"], key_str))
+
+        line = self._json_line({"key": key_str, "meta": meta})
+        with open(self._wal_path, "ab") as f:
+            f.write(line)
+        self._wal_entries += 1
+        # 按会话数放大阈值，合并快照的 O(会话数) 开销均摊到每次保存为 O(1)
+        if self._wal_entries >= max(
+            self.METADATA_COMPACT_THRESHOLD, 2 * len(self._metadata)
+        ):
+            self._compact_metadata()
+
+    def _compact_metadata(self):
+        """把完整元数据原子地写回 sessions.json，并清空变更日志。"""
+        tmp_path = self._metadata_path.with_name(f".sessions.json.{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(self._json_line(self._metadata))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._metadata_path)
+        # 快照落盘后再截断日志；中途崩溃时重放日志是幂等的
+        open(self._wal_path, "wb").close()
+        self._wal_entries = 0
+
+    def _iter_transcript(
+        self, session_id: str, limit: Optional[int] = None
+    ) -> Iterator[Message]:
+        """
+        逐条读取 JSONL 转录文件中的消息。
 
-        if path.exists():
-            with open(path, "r", encoding="utf-8") as f:
-                for line in f:
-                    line = line.strip()
-                    if line:
-                        try:
-                            data = json.loads(line)
-                            messages.append(Message.from_dict(data))
-                        except Exception:
-                            pass
+        指定 limit 时只解码最后 limit 行: 未压缩的转录从文件末尾向前按块读取，
+        不扫描整个文件；压缩归档无法向前定位，顺序扫描时只保留最后 limit 行。
+        """
+        path = self._transcript_path(session_id)
+        opener = open
+        if not path.exists():
+            path = self._archive_path(session_id)
+            if not path.exists():
+                return
+            import gzip
+
+            opener = gzip.open
+        with opener(path, "rb") as f:
+            if limit and opener is open:
+                lines = self._tail_lines(f, limit)
+            else:
+                lines = (line for line in f if not line.isspace())
+                if limit:
+                    lines = deque(lines, maxlen=limit)
+            for line in lines:
+                try:
+                    yield Message.from_dict(_json_loads(line))
+                except Exception:
+                    pass
+
+    def _tail_lines(self, f, limit: int) -> List[bytes]:
+        """从文件末尾向前按块读取，返回最后 limit 个非空行。"""
+        pos = f.seek(0, os.SEEK_END)
+        head = b""  # 块首尚不完整的行，与前一块拼接
+        found: List[bytes] = []  # 从后往前收集的完整行
+        while pos > 0 and len(found) < limit:
+            step = min(self.TAIL_BLOCK_SIZE, pos)
+            pos -= step
+            f.seek(pos)
+            parts = (f.read(step) + head).split(b"\n")
+            head = parts[0]
+            found.extend(line for line in reversed(parts[1:]) if line.strip())
+        if pos == 0 and head.strip():
+            # 已读到文件开头，第一行是完整的
+            found.append(head)
+        found = found[:limit]
+        found.reverse()
+        return found
+
+    def _load_transcript(
+        self, session_id: str, limit: Optional[int] = None
+    ) -> List[Message]:
+        """
+        从 JSONL 转录文件加载消息。
 
+        压缩记录 (metadata["kept"] 为压缩时保留的最近消息数) 按写入时的效果重放:
+        替换它之前除最近 kept 条以外的所有消息，与压缩后内存中的会话一致。
+        """
+        messages: List[Message] = []
+        for msg in self._iter_transcript(session_id, limit):
+            if msg.role == MessageRole.COMPACTION and "kept" in msg.metadata:
+                kept = msg.metadata["kept"]
+                messages = [msg] + (messages[-kept:] if kept else [])
+            else:
+                messages.append(msg)
         return messages
 
-    def _append_to_transcript(self, session_id: str, message: Message):
-        """追加消息到 JSONL 转录文件。"""
+    def _append_to_transcript(self, session_id: str, messages: List[Message]):
+        """追加消息到 JSONL 转录文件，一批消息只打开文件并写入一次。"""
+        if not messages:
+            return
+        data = b"".join(self._json_line(m.to_dict()) for m in messages)
+        with open(self._transcript_path(session_id), "ab") as f:
+            f.write(data)
+
+    def _json_line(self, data: Dict[str, Any]) -> bytes:
+        """编码一行 JSONL，安装了 orjson 时使用它编码。"""
+        if orjson is not None:
+            try:
+                return orjson.dumps(data, option=orjson.OPT_APPEND_NEWLINE)
+            except TypeError:
+                # orjson 不支持的类型 (如非字符串键) 交给标准库处理
+                pass
+        return (json.dumps(data, ensure_ascii=False) + "\n").encode("utf-8")
+
+    def _archive_transcript(self, session_id: str):
+        """把不再使用的转录文件压缩为 .jsonl.gz 归档并删除原文件。"""
         path = self._transcript_path(session_id)
-        with open(path, "a", encoding="utf-8") as f:
-            f.write(json.dumps(message.to_dict(), ensure_ascii=False) + "\n")
+        if not path.exists():
+            return
+        import gzip
+
+        archive = self._archive_path(session_id)
+        # 先写临时文件再替换，回退读取归档时不会读到压缩了一半的文件
+        tmp = archive.with_name(archive.name + ".tmp")
+        with open(path, "rb") as src, gzip.open(tmp, "wb", compresslevel=6) as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(tmp, archive)
+        path.unlink()
 
     def _generate_session_id(self) -> str:
-        """生成唯一的会话 ID。"""
-        import uuid
-
-        return uuid.uuid4().hex[:12]
+        """生成唯一的会话 ID (12 位十六进制，48 位随机数)。"""
+        return secrets.token_hex(6)
 
     def get(self, key: str | SessionKey) -> Session:
         """
@@ -444,18 +696,28 @@ class SessionStore:
         # 检查会话是否存在且仍然有效
         if key_str in self._metadata:
             meta = self._metadata[key_str]
-            updated_at = datetime.fromisoformat(meta["updated_at"])
+            # 已缓存的会话直接使用内存中的时间 (不早于元数据中的)，无需解析字符串
+            session = self._sessions.get(key_str)
+            if session is not None:
+                updated_at = session.updated_at
+            else:
+                updated_at = datetime.fromisoformat(meta["updated_at"])
 
             if self.reset_policy.is_expired(updated_at):
                 # 会话已过期 - 创建新的
                 return self._create_session(key)
 
             # 从缓存或磁盘加载
-            if key_str not in self._sessions:
-                messages = self._load_transcript(meta["session_id"])
-                self._sessions[key_str] = Session.from_dict(meta, messages)
+            if session is None:
+                messages = self._load_transcript(
+                    meta["session_id"], self.max_loaded_messages
+                )
+                session = Session.from_dict(meta, messages, self.token_estimator)
+                self._cache_session(key_str, session)
+            else:
+                self._sessions.move_to_end(key_str)
 
-            return self._sessions[key_str]
+            return session
 
         # 创建新会话
         return self._create_session(key)
@@ -463,29 +725,99 @@ class SessionStore:
     def _create_session(self, key: SessionKey) -> Session:
         """创建新会话。"""
         session_id = self._generate_session_id()
-        session = Session(key=key, session_id=session_id)
+        session = Session(
+            key=key, session_id=session_id, token_estimator=self.token_estimator
+        )
 
         key_str = str(key)
-        self._sessions[key_str] = session
-        self._metadata[key_str] = session.to_dict()
-        self._save_metadata()
+        old = self._metadata.get(key_str)
+        previous = self._sessions.get(key_str)
+        if previous is not None:
+            # 旧会话中尚未写入的消息先落盘，再归档
+            self._flush_pending(previous)
+        self._cache_session(key_str, session)
+        self._save_metadata(key_str, session.to_dict())
+
+        # 旧会话 (过期或被重置) 的转录不会再追加，压缩归档
+        if old is not None:
+            self._schedule_archive(old["session_id"])
 
         return session
 
-    def save(self, session: Session, message: Optional[Message] = None):
+    def _schedule_archive(self, session_id: str):
+        """归档旧转录: 在事件循环中交给线程执行，压缩大文件不阻塞消息处理。"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._archive_transcript(session_id)
+            return
+        future = loop.run_in_executor(None, self._archive_transcript, session_id)
+        self._archives.add(future)
+        future.add_done_callback(self._archives.discard)
+
+    async def wait_archives(self):
+        """等待进行中的转录归档完成 (关闭前调用)。"""
+        if self._archives:
+            await asyncio.gather(*self._archives, return_exceptions=True)
+
+    def _cache_session(self, key_str: str, session: Session):
+        """
+        放入 LRU 缓存，超出上限时淘汰最久未使用的会话。
+
+        有未写入消息的会话 (通常正被请求使用) 不淘汰，否则下次 get() 会从磁盘
+        加载出缺少这些消息的第二个副本；缓存因此可能暂时超出上限。
+        """
+        self._sessions[key_str] = session
+        self._sessions.move_to_end(key_str)
+        excess = len(self._sessions) - self.max_cached_sessions
+        if excess <= 0:
+            return
+        victims = []
+        for old_key, old in self._sessions.items():
+            if len(victims) == excess:
+                break
+            if not old._pending and old is not session:
+                victims.append(old_key)
+        for old_key in victims:
+            old = self._sessions.pop(old_key)
+            # 淘汰前保存元数据，内存中未保存的计数和时间不会丢失
+            meta = self._metadata.get(old_key)
+            if meta is not None and meta["session_id"] == old.session_id:
+                self.save(old)
+
+    def save(
+        self,
+        session: Session,
+        message: Optional[Message] = None,
+        messages: Optional[List[Message]] = None,
+    ):
         """
         保存会话状态。
 
-        如果提供了消息，将其追加到转录文件。
-        始终更新元数据。
+        把 add_message 之后尚未写入的消息，连同显式提供的消息 (单条 message
+        或一批 messages)，合并为一次写入追加到转录文件。始终更新元数据。
         """
         key_str = str(session.key)
-
-        if message:
-            self._append_to_transcript(session.session_id, message)
-
-        self._metadata[key_str] = session.to_dict()
-        self._save_metadata()
+        meta = self._metadata.get(key_str)
+        if meta is not None and meta["session_id"] != session.session_id:
+            # 会话已被过期或重置替换 (替换前已写入其待写消息)，旧转录可能已归档，
+            # 不再追加，也不把旧 ID 写回元数据
+            return
+
+        extra = [message] if message else []
+        if messages:
+            extra.extend(messages)
+        self._flush_pending(session, extra)
+        self._save_metadata(key_str, session.to_dict())
+
+    def _flush_pending(self, session: Session, extra: Optional[List[Message]] = None):
+        """把会话待写入的消息一次性追加到转录文件。"""
+        pending = session._pending
+        if extra:
+            queued = {id(m) for m in pending}
+            pending = pending + [m for m in extra if id(m) not in queued]
+        self._append_to_transcript(session.session_id, pending)
+        session._pending.clear()
 
     def reset(self, key: str | SessionKey) -> Session:
         """强制重置会话 (如 /new 或 /reset)。"""
@@ -494,18 +826,17 @@ class SessionStore:
         return self._create_session(key)
 
     def list(self, active_minutes: Optional[int] = None) -> List[Dict]:
-        """列出所有会话，可选按活动时间过滤。"""
-        now = datetime.now()
-        results = []
-
-        for key, meta in self._metadata.items():
-            updated_at = datetime.fromisoformat(meta["updated_at"])
-
-            if active_minutes:
-                threshold = now - timedelta(minutes=active_minutes)
-                if updated_at < threshold:
-                    continue
+        """列出所有会话 (最近更新的在前)，可选按活动时间过滤。"""
+        # 本地时间的 ISO 字符串按字典序比较与按时间比较一致
+        threshold = None
+        if active_minutes:
+            threshold = (datetime.now() - timedelta(minutes=active_minutes)).isoformat()
 
+        results = []
+        for updated_at, key in reversed(self._by_updated):
+            if threshold is not None and updated_at < threshold:
+                break
+            meta = self._metadata[key]
             results.append(
                 {
                     "key": key,
@@ -515,7 +846,7 @@ class SessionStore:
                 }
             )
 
-        return sorted(results, key=lambda x: x["updated_at"], reverse=True)
+        return results
 
     def delete(self, key: str | SessionKey) -> bool:
         """删除会话。"""
@@ -533,8 +864,7 @@ class SessionStore:
                 transcript.unlink()
 
             # 从元数据中删除
-            del self._metadata[key_str]
-            self._save_metadata()
+            self._save_metadata(key_str, None)
 
             # 从缓存中删除
             if key_str in self._sessions:
@@ -569,9 +899,14 @@ class Compactor:
         self.soft_threshold = soft_threshold
 
     def should_compact(
-        self, session: Session, context_window: int, current_tokens: int
+        self,
+        session: Session,
+        context_window: int,
+        current_tokens: Optional[int] = None,
     ) -> bool:
-        """检查是否需要压缩。"""
+        """检查是否需要压缩。未提供 current_tokens 时使用会话缓存的估算总数。"""
+        if current_tokens is None:
+            current_tokens = session.message_tokens
         available = context_window - self.reserve_tokens - self.soft_threshold
         return current_tokens > available
 
@@ -600,11 +935,19 @@ class Compactor:
         compaction_msg = Message(
             role=MessageRole.COMPACTION,
             content=summary,
-            metadata={"compacted_count": len(to_summarize)},
+            metadata={"compacted_count": len(to_summarize), "kept": keep_recent},
         )
 
-        # 替换消息
+        # 替换消息，增量更新 token 总数
         session.messages = [compaction_msg] + to_keep
+        # 被总结的消息不再写入转录；压缩记录排在保留的消息之后写入，
+        # 重新加载时据 kept 重放，得到与内存一致的消息列表
+        kept_ids = {id(m) for m in to_keep}
+        session._pending = [m for m in session._pending if id(m) in kept_ids]
+        session._pending.append(compaction_msg)
+        session.message_tokens += session.count_tokens(compaction_msg) - sum(
+            m.token_count or 0 for m in to_summarize
+        )
         session.compaction_count += 1
         session.last_compaction_at = datetime.now()
 
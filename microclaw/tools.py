@@ -8,10 +8,21 @@
 - @tool 装饰器: 简单的工具注册方式
 """
 
+import asyncio
 import inspect
 from dataclasses import dataclass, field
 from typing import Any, Callable, Dict, List, Optional
 
+# Python 类型到 JSON Schema 类型的映射，未列出的类型按 string 处理
+_TYPE_MAP = {
+    str: "string",
+    int: "integer",
+    float: "number",
+    bool: "boolean",
+    list: "array",
+    dict: "object",
+}
+
 
 @dataclass
 class Tool:
@@ -21,13 +32,22 @@ class Tool:
     description: str
     handler: Callable
     parameters: Dict[str, Any] = field(default_factory=dict)
+    # 缓存的 JSON Schema，首次调用 to_schema 时构建
+    _schema: Optional[Dict[str, Any]] = field(
+        default=None, init=False, repr=False, compare=False
+    )
 
     def __call__(self, **kwargs) -> Any:
         """使用给定参数执行工具。"""
         return self.handler(**kwargs)
 
     def to_schema(self) -> Dict[str, Any]:
-        """转换为 LLM 的 JSON Schema。"""
+        """转换为 LLM 的 JSON Schema (构建一次后复用，调用方不应修改)。"""
+        if self._schema is None:
+            self._schema = self._build_schema()
+        return self._schema
+
+    def _build_schema(self) -> Dict[str, Any]:
         return {
             "type": "function",
             "function": {
@@ -51,10 +71,12 @@ class ToolRegistry:
 
     def __init__(self):
         self._tools: Dict[str, Tool] = {}
+        self._schemas: Optional[List[Dict[str, Any]]] = None
 
     def register(self, tool: Tool) -> None:
         """注册工具。"""
         self._tools[tool.name] = tool
+        self._schemas = None
 
     def get(self, name: str) -> Optional[Tool]:
         """按名称获取工具。"""
@@ -65,8 +87,10 @@ class ToolRegistry:
         return list(self._tools.values())
 
     def schemas(self) -> List[Dict[str, Any]]:
-        """获取所有工具的 JSON Schema。"""
-        return [t.to_schema() for t in self._tools.values()]
+        """获取所有工具的 JSON Schema (注册变化前复用同一列表，调用方不应修改)。"""
+        if self._schemas is None:
+            self._schemas = [t.to_schema() for t in self._tools.values()]
+        return self._schemas
 
     async def execute(self, name: str, arguments: Dict[str, Any]) -> Any:
         """按名称使用给定参数执行工具。"""
@@ -103,17 +127,8 @@ def tool(name: Optional[str] = None, description: Optional[str] = None) -> Calla
                 continue
 
             param_type = hints.get(param_name, Any)
-            type_map = {
-                str: "string",
-                int: "integer",
-                float: "number",
-                bool: "boolean",
-                list: "array",
-                dict: "object",
-            }
-
             parameters[param_name] = {
-                "type": type_map.get(param_type, "string"),
+                "type": _TYPE_MAP.get(param_type, "string"),
                 "description": f"{param_name} 参数",
             }
 
@@ -174,8 +189,14 @@ def _translate_command(command: str) -> str:
 
 
 @tool(description="执行 shell 命令并返回输出")
-def shell_exec(command: str) -> str:
+async def shell_exec(command: str) -> str:
     """运行 shell 命令。命令会在工作区目录中执行。"""
+    # 在线程中等待子进程，最长 30 秒的命令不会阻塞事件循环
+    return await asyncio.to_thread(_run_shell, command)
+
+
+def _run_shell(command: str) -> str:
+    """同步执行 shell 命令 (shell_exec 的实现)。"""
     import os
     import subprocess
     from pathlib import Path
@@ -223,9 +244,14 @@ def shell_exec(command: str) -> str:
 
 
 @tool(description="读取文件内容")
-def read_file(path: str) -> str:
-    """从磁盘读取文件。优先从工作区目录读取。"""
+def read_file(path: str, max_bytes: int = 262144, offset: int = 0) -> str:
+    """从磁盘读取文件。优先从工作区目录读取。最多读取 max_bytes 字节。"""
+    if max_bytes <= 0:
+        return f"读取文件错误: max_bytes 必须为正数: {max_bytes}"
+    if offset < 0:
+        return f"读取文件错误: offset 不能为负数: {offset}"
     try:
+        import codecs
         import os
         from pathlib import Path
 
@@ -234,19 +260,41 @@ def read_file(path: str) -> str:
             os.environ.get("MICROCLAW_WORKSPACE", "~/.microclaw/workspace")
         ).expanduser()
 
-        # 如果是相对路径，先检查工作区
-        if not os.path.isabs(path):
-            workspace_path = workspace_dir / path
-            if workspace_path.exists():
-                with open(str(workspace_path), "r", encoding="utf-8") as f:
-                    return f.read()
-
-        # 尝试当前目录或绝对路径
-        if os.path.exists(path):
-            with open(path, "r", encoding="utf-8") as f:
-                return f.read()
-
-        return f"读取文件错误: 文件不存在: {path}"
+        # 如果是相对路径，先检查工作区，再尝试当前目录或绝对路径
+        target = None
+        if not os.path.isabs(path) and (workspace_dir / path).exists():
+            target = str(workspace_dir / path)
+        elif os.path.exists(path):
+            target = path
+        if target is None:
+            return f"读取文件错误: 文件不存在: {path}"
+
+        # 只读取需要的部分，多读 1 字节用于判断是否截断
+        with open(target, "rb") as f:
+            if offset:
+                f.seek(offset)
+            data = f.read(max_bytes + 1)
+
+        truncated = len(data) > max_bytes
+        # 截断处可能切开多字节字符，增量解码器会丢弃末尾不完整的字节
+        text = codecs.getincrementaldecoder("utf-8")().decode(
+            data[:max_bytes], final=not truncated
+        )
+        # 实际解码的字节数 (不含被丢弃的半个字符)
+        consumed = len(text.encode("utf-8"))
+        if text.endswith("\r") and data[consumed : consumed + 1] == b"\n":
+            # 截断处切开了 \r\n: 把 \n 一并读入，否则续读时会多出一个空行
+            text += "\n"
+            consumed += 1
+        if truncated and not consumed:
+            return f"读取文件错误: max_bytes 过小，无法读取 offset={offset} 处的完整字符"
+        # 下次读取的起点
+        next_offset = offset + consumed
+        # 与文本模式一致，统一换行符
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+        if truncated:
+            text += f"\n...[已截断: 可用 offset={next_offset} 继续读取]"
+        return text
     except Exception as e:
         return f"读取文件错误: {e}"
 
@@ -256,6 +304,8 @@ def write_file(path: str, content: str) -> str:
     """将内容写入文件。相对路径会写入工作区目录。"""
     try:
         import os
+        import stat
+        import threading
         from pathlib import Path
 
         # 工作区目录
@@ -269,9 +319,33 @@ def write_file(path: str, content: str) -> str:
         else:
             full_path = Path(path)
 
-        full_path.parent.mkdir(parents=True, exist_ok=True)
-        with open(str(full_path), "w", encoding="utf-8") as f:
-            f.write(content)
+        # 先写入同目录的临时文件再原子替换，读者不会看到写了一半的文件；
+        # 写入符号链接指向的真实文件，保留链接本身
+        target = Path(os.path.realpath(full_path))
+        tmp = target.with_name(
+            f".{target.name}.{os.getpid()}.{threading.get_ident()}.tmp"
+        )
+        try:
+            try:
+                f = open(tmp, "w", encoding="utf-8")
+            except FileNotFoundError:
+                # 只在目录不存在时才创建，常见情况省去一次 stat
+                target.parent.mkdir(parents=True, exist_ok=True)
+                f = open(tmp, "w", encoding="utf-8")
+            with f:
+                f.write(content)
+            try:
+                # 保留原文件的权限
+                os.chmod(tmp, stat.S_IMODE(os.stat(target).st_mode))
+            except OSError:
+                pass
+            os.replace(tmp, target)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
         return f"成功写入 {len(content)} 字节到 {path}"
     except Exception as e:
         return f"写入文件错误: {e}"
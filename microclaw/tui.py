@@ -22,7 +22,13 @@ from rich.table import Table
 from rich.text import Text
 
 from .agent import Agent, AgentConfig
-from .session import MessageRole, ResetPolicy, SessionKey, SessionStore
+from .session import (
+    MessageRole,
+    ResetPolicy,
+    SessionKey,
+    SessionStore,
+    estimate_tokens,
+)
 
 
 class Theme:
@@ -72,7 +78,9 @@ class TUI:
         # 初始化会话存储
         storage_dir = str(Path(self.config.workspace_dir).expanduser() / "sessions")
         self.session_store = session_store or SessionStore(
-            storage_dir=storage_dir, reset_policy=ResetPolicy(mode="daily", at_hour=4)
+            storage_dir=storage_dir,
+            reset_policy=ResetPolicy(mode="daily", at_hour=4),
+            token_estimator=estimate_tokens,
         )
 
         # 当前会话
@@ -0,0 +1,26 @@
+"""Agent 测试 (不调用 LLM)。"""
+
+import asyncio
+
+from microclaw.agent import Agent, AgentConfig
+from microclaw.session import Compactor, MessageRole, Session, SessionKey
+
+
+def test_run_compacts_when_context_is_full():
+    async def summarize(messages, instructions=None):
+        return f"摘要 {len(messages)}"
+
+    agent = Agent.__new__(Agent)
+    agent.config = AgentConfig(context_window=200)
+    agent._compactor = Compactor(summarize, reserve_tokens=0, soft_threshold=0)
+
+    session = Session(key=SessionKey.for_dm(agent_id="main"), session_id="s")
+    for i in range(30):
+        session.add_message(MessageRole.USER, f"消息 {i} " * 5)
+
+    asyncio.run(agent._maybe_compact(session))
+
+    assert session.compaction_count == 1
+    assert session.messages[0].role == MessageRole.COMPACTION
+    assert session.messages[0].content == "摘要 20"
+    assert len(session.messages) == 11
@@ -0,0 +1,21 @@
+"""Gateway 测试 (不调用 LLM)。"""
+
+from datetime import timedelta
+
+from microclaw.gateway import Gateway, GatewayConfig
+from microclaw.session import MessageRole, SessionKey
+
+
+def test_expired_session_drops_pending_save(tmp_path):
+    gateway = Gateway(
+        GatewayConfig(storage_dir=str(tmp_path), reset_mode="idle", idle_minutes=5)
+    )
+    key = SessionKey.for_dm(agent_id="main")
+    old = gateway._get_session(key)
+    old.add_message(MessageRole.USER, "旧消息")
+    gateway._dirty_sessions[str(key)] = old
+    old.updated_at -= timedelta(minutes=10)
+
+    new = gateway._get_session(key)
+    assert new is not old
+    assert str(key) not in gateway._dirty_sessions
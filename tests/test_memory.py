@@ -0,0 +1,25 @@
+"""工作区记忆测试。"""
+
+from microclaw.memory import MemoryConfig, WorkspaceFiles
+
+
+def test_read_skill_resource_caches_only_existing_skills(tmp_path):
+    workspace = WorkspaceFiles(MemoryConfig(workspace_dir=str(tmp_path)))
+    skill_dir = workspace.skills_dir / "demo"
+    skill_dir.mkdir(parents=True)
+    (skill_dir / "notes.md").write_text("内容", encoding="utf-8")
+
+    assert workspace.read_skill_resource("demo", "notes.md") == "内容"
+    for i in range(50):
+        assert workspace.read_skill_resource(f"编造-{i}", "notes.md") is None
+    workspace.read_skill_resource("..", "MEMORY.md")
+    assert list(workspace._skill_roots) == ["demo"]
+    # 路径穿越仍被拒绝
+    assert workspace.read_skill_resource("demo", "../../SOUL.md") is None
+
+
+def test_read_mapped_handles_file_emptied_after_stat(tmp_path):
+    workspace = WorkspaceFiles(MemoryConfig(workspace_dir=str(tmp_path)))
+    path = tmp_path / "empty.md"
+    path.write_bytes(b"")
+    assert workspace._read_mapped(path) == ""
@@ -0,0 +1,114 @@
+"""会话存储测试。"""
+
+import asyncio
+from datetime import timedelta
+
+from microclaw.session import (
+    Compactor,
+    MessageRole,
+    ResetPolicy,
+    SessionStore,
+    estimate_tokens,
+)
+
+
+def _fill(storage_dir, count: int) -> str:
+    store = SessionStore(str(storage_dir))
+    session = store.get("agent:main:main")
+    for i in range(count):
+        session.add_message(MessageRole.USER, f"消息 {i}")
+    store.save(session)
+    return session.session_id
+
+
+def test_get_loads_only_recent_messages(tmp_path, monkeypatch):
+    session_id = _fill(tmp_path, 50)
+    # 小块读取，覆盖跨块拼接的行
+    monkeypatch.setattr(SessionStore, "TAIL_BLOCK_SIZE", 7)
+
+    store = SessionStore(str(tmp_path), max_loaded_messages=10)
+    session = store.get("agent:main:main")
+    assert session.session_id == session_id
+    assert [m.content for m in session.messages] == [
+        f"消息 {i}" for i in range(40, 50)
+    ]
+
+
+def test_get_loads_all_messages_without_limit(tmp_path):
+    _fill(tmp_path, 5)
+    session = SessionStore(str(tmp_path), max_loaded_messages=10).get(
+        "agent:main:main"
+    )
+    assert len(session.messages) == 5
+    assert len(SessionStore(str(tmp_path)).get("agent:main:main").messages) == 5
+
+
+def test_loaded_sessions_count_tokens_for_compaction(tmp_path):
+    _fill(tmp_path, 50)
+    store = SessionStore(str(tmp_path), token_estimator=estimate_tokens)
+    session = store.get("agent:main:main")
+    assert session.message_tokens == sum(
+        estimate_tokens(m.content) for m in session.messages
+    )
+
+    compactor = Compactor(summarize_fn=None, reserve_tokens=0, soft_threshold=0)
+    assert compactor.should_compact(session, context_window=100)
+    assert not compactor.should_compact(session, context_window=100000)
+
+
+def test_compaction_survives_reload(tmp_path):
+    async def summarize(messages, instructions=None):
+        return f"摘要 {len(messages)}"
+
+    store = SessionStore(str(tmp_path))
+    session = store.get("agent:main:main")
+    for i in range(20):
+        session.add_message(MessageRole.USER, f"消息 {i}")
+    store.save(session)
+    # 一部分消息尚未保存时压缩
+    for i in range(20, 30):
+        session.add_message(MessageRole.USER, f"消息 {i}")
+    asyncio.run(Compactor(summarize).compact(session, keep_recent=5))
+    assert len(session._pending) == 6
+    session.add_message(MessageRole.USER, "消息 30")
+    store.save(session)
+
+    reloaded = SessionStore(str(tmp_path)).get("agent:main:main")
+    assert [m.content for m in reloaded.messages] == [
+        m.content for m in session.messages
+    ]
+    assert reloaded.messages[0].content == "摘要 25"
+
+
+def test_save_ignores_session_replaced_by_expiry(tmp_path):
+    store = SessionStore(
+        str(tmp_path), reset_policy=ResetPolicy(mode="idle", idle_minutes=5)
+    )
+    old = store.get("agent:main:main")
+    old.add_message(MessageRole.USER, "旧消息")
+    old.updated_at -= timedelta(minutes=10)
+
+    new = store.get("agent:main:main")
+    assert new.session_id != old.session_id
+    # 替换前已写入旧会话的消息并归档
+    assert [m.content for m in store._load_transcript(old.session_id)] == ["旧消息"]
+
+    store.save(old)
+    assert store._metadata["agent:main:main"]["session_id"] == new.session_id
+    assert not store._transcript_path(old.session_id).exists()
+
+
+def test_eviction_keeps_sessions_with_unsaved_messages(tmp_path):
+    store = SessionStore(str(tmp_path), max_cached_sessions=1)
+    busy = store.get("agent:main:a")
+    busy.add_message(MessageRole.USER, "未保存")
+
+    store.get("agent:main:b")
+    store.get("agent:main:c")
+    assert store.get("agent:main:a") is busy
+
+    store.save(busy)
+    store.get("agent:main:b")
+    assert "agent:main:a" not in store._sessions
+    reloaded = store.get("agent:main:a")
+    assert [m.content for m in reloaded.messages] == ["未保存"]
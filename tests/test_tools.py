@@ -0,0 +1,49 @@
+"""内置工具测试。"""
+
+import random
+import re
+
+from microclaw.tools import read_file
+
+_MARKER = re.compile(r"\n\.\.\.\[已截断: 可用 offset=(\d+) 继续读取\]$")
+
+
+def _read_chunked(path: str, max_bytes: int) -> str:
+    """按 max_bytes 分段续读整个文件，返回拼接后的文本。"""
+    parts = []
+    offset = 0
+    while True:
+        text = read_file(path=path, max_bytes=max_bytes, offset=offset)
+        match = _MARKER.search(text)
+        if match is None:
+            parts.append(text)
+            return "".join(parts)
+        next_offset = int(match.group(1))
+        assert next_offset > offset
+        parts.append(text[: match.start()])
+        offset = next_offset
+
+
+def test_read_file_chunked_crlf_round_trip(tmp_path):
+    rng = random.Random(0)
+    for i in range(200):
+        lines = [
+            "".join(rng.choice("ab你好 ") for _ in range(rng.randint(0, 6)))
+            for _ in range(rng.randint(1, 20))
+        ]
+        newline = rng.choice(["\r\n", "\n"])
+        path = tmp_path / f"{i}.txt"
+        path.write_bytes(newline.join(lines).encode("utf-8"))
+        expected = "\n".join(lines)
+        for max_bytes in (4, 5, 7, 16):
+            assert _read_chunked(str(path), max_bytes) == expected
+
+
+def test_read_file_rejects_invalid_bounds(tmp_path):
+    path = tmp_path / "a.txt"
+    path.write_text("hello", encoding="utf-8")
+    assert "max_bytes" in read_file(path=str(path), max_bytes=0)
+    assert "offset" in read_file(path=str(path), offset=-1)
+    # 不足一个完整字符时报错，而不是返回原地不动的 offset
+    path.write_text("你好", encoding="utf-8")
+    assert read_file(path=str(path), max_bytes=1).startswith("读取文件错误")